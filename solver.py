@@ -3,10 +3,19 @@
 # Author: Daniel Myers (dmyers@rollins.edu)
 # Date: May 2016
 
+import sys
 import random
 import copy
 import heapq
 import time
+import os
+import hashlib
+import tempfile
+import multiprocessing
+import collections
+import abc
+
+import numpy as np
 
 INSTRUCTOR_OVERLAP_WEIGHT = 15
 INSTRUCTOR_CONFLICT_PENALTY = 400
@@ -33,6 +42,12 @@ NUM_VERTICES_TO_EXPAND = 1
 NUM_COLORS_PER_VERTEX = 2
 MAX_QUEUE_LENGTH = 5
 
+# The priority queue search skips partial colorings it has already
+# expanded, remembering the most recent TRANSPOSITION_TABLE_SIZE of them
+# by their Zobrist hashes
+TRANSPOSITION_TABLE_SIZE = 100000
+ZOBRIST_SEED = 0
+
 #PRIORITY_TOTAL_PENALTY_WEIGHT = 31.41
 #PRIORITY_TOTAL_BAD_VALUE_WEIGHT = .15
 #PRIORITY_TOTAL_EDGE_WEIGHT = 6.11
@@ -47,65 +62,495 @@ PRIORITY_BAD_VALUE_OF_EDGES = 23
 
 USE_ONE_PASS = True
 
+# Improve the constructed schedule with simulated annealing instead of
+# tabu search
+USE_ANNEALING = False
+
+# Number of randomized one-pass starts run by schedule_ctb_file, each
+# followed by improvement; 1 runs the deterministic solver once
+NUM_STARTS = 1
+
+# Randomness of a multi-start run: the bad value of colors of each
+# vertex is scaled by a random factor in [1, 1 + MULTI_START_NOISE], and
+# the color is sampled from the MULTI_START_TOP_K best candidates. On
+# Fall 2015, sampling colors gave much worse schedules than reordering
+# the vertices, so it is off by default.
+MULTI_START_NOISE = 0.3
+MULTI_START_TOP_K = 1
+
+# Worker processes for the starts, or None for one per CPU
+MULTI_START_PROCESSES = None
+
+# Seconds before the deadline of a solve at which the starts stop, kept
+# for returning their schedules, joining the pool, and assigning the
+# best schedule, which take about 0.25 s on Fall 2015
+MULTI_START_DEADLINE_RESERVE = 0.3
+
 PRINT_CONFLICTS = False
 
-def get_remaining_timeslots(vertex, solution, vertices, edges, overlapping_timeslots):
+# Time limit in seconds for the solve in schedule_ctb_file, or None for
+# no limit beyond those of the improvement engines
+SOLVE_TIME_LIMIT = None
+
+# Seconds between the progress events reported while a solver runs
+PROGRESS_INTERVAL = 1.0
+
+# Recompute the penalty and the priority queue features from scratch
+# whenever their running totals are read and report any difference
+CHECK_PENALTY_TOTALS = False
+
+# Tabu search improvement phase: a section may not return to a timeslot
+# it left for TABU_TENURE moves, and the search stops after
+# TABU_MAX_ITERATIONS moves or TABU_MAX_STALL moves without a new best
+# schedule. TABU_TIME_LIMIT is an optional cap in seconds; with None the
+# search depends only on TABU_SEED, which seeds its tie-breaking, and
+# gives the same schedule on every run.
+TABU_TENURE = 50
+TABU_MAX_ITERATIONS = 3000
+TABU_TIME_LIMIT = None
+TABU_MAX_STALL = 2000
+TABU_SEED = 0
+
+# Added to the penalty change of a non-improving move for each earlier
+# move of the same section, to push the search off plateaus
+TABU_FREQUENCY_PENALTY = 50
+
+# Number of moves to timeslots without an open room that the tabu search
+# tries to make room for on each iteration
+TABU_REPAIR_CANDIDATES = 10
+
+# Simulated annealing: the temperature changes every
+# SA_STEPS_PER_TEMPERATURE attempted moves, by the factor
+# SA_COOLING_RATE. The starting temperature accepts a median worsening
+# move with probability SA_INITIAL_ACCEPTANCE. After SA_REHEAT_AFTER
+# temperature steps without a new best schedule, the temperature is
+# raised to SA_REHEAT_FRACTION of the starting temperature. The search
+# makes SA_MAX_STEPS attempted moves, about 2 s on Fall 2015, with
+# SA_TIME_LIMIT as an optional cap in seconds, and draws from a
+# random.Random seeded with SA_SEED, so a run is reproducible.
+SA_MAX_STEPS = 30000
+SA_TIME_LIMIT = None
+SA_SEED = 0
+SA_COOLING_RATE = 0.95
+SA_STEPS_PER_TEMPERATURE = 100
+SA_INITIAL_ACCEPTANCE = 0.05
+SA_REHEAT_AFTER = 30
+SA_REHEAT_FRACTION = 0.1
+
+# Probability that an annealing move is a section swap, a room move, or
+# a Kempe chain interchange; all other moves are timeslot moves
+SA_SWAP_PROBABILITY = 0.3
+SA_ROOM_MOVE_PROBABILITY = 0.1
+SA_KEMPE_PROBABILITY = 0.15
+
+# Largest number of sections a Kempe chain interchange may move
+KEMPE_CHAIN_LIMIT = 40
+
+# Large neighbourhood search: each iteration unassigns up to
+# LNS_NEIGHBORHOOD_SIZE sections and rebuilds them with the one-pass
+# greedy. A room neighbourhood holds the sections in one room that meet
+# within LNS_BAND_WIDTH minutes of a section in the room. The rebuild
+# orders the sections with a random factor in [1, 1 + LNS_NOISE] and
+# samples colors from the LNS_TOP_K best candidates, as in a multi-start
+# run. The search draws from a random.Random seeded with LNS_SEED.
+LNS_TIME_LIMIT = 2.0
+LNS_NEIGHBORHOOD_SIZE = 20
+LNS_BAND_WIDTH = 60
+LNS_NOISE = 0.3
+LNS_TOP_K = 1
+LNS_SEED = 0
+
+# Dense id used for the timeslot or room of a section that could not
+# be scheduled
+UNASSIGNED = -1
+
+# Directory holding the cached timeslot overlap and gap matrices, or None
+# to always rebuild them
+TIMESLOT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timeslot_cache')
+
+# Bump when the layout or meaning of the cached matrices changes
+TIMESLOT_CACHE_VERSION = 1
+
+
+#--- Compact model of a timetabling problem
+#
+# Sections, timeslots, and rooms are interned to dense integer ids, so
+# the solver never hashes names in its inner loops. Names are only
+# needed when reading input and reporting results.
+#
+# The penalty state is kept in (section x timeslot) NumPy arrays:
+#
+#   conflict_penalty[s, t]: penalty incurred by assigning t to s given
+#                           the current assignments of its neighbors
+#   proximity_penalty[s, t]: the same for the proximity penalty
+#
+# timeslot_mask[s, t] is True if t is an acceptable timeslot for s.
+# Entries for other timeslots are kept at zero. The arrays grow
+# geometrically as sections are added, so they may have spare rows
+# beyond num_sections.
+#
+# The open rooms are kept in a flat list at position s * num_timeslots + t:
+#
+#   unassigned_rooms: a bitmask of the acceptable rooms of s still open
+#                     at t, with bit r set if room r is open
+#
+# The mask is 0 for timeslots that are not acceptable for s, and
+# room_masks[s] gives the mask of all acceptable rooms of s.
+# sole_room_count[r, t] counts the sections whose only open room at t
+# is r, and has_open_room[s, t] is True if the mask of s at t is not
+# empty. All changes to the masks go through set_open_rooms, which keeps
+# both up to date.
+#
+# The two parts of the good to bad switch value are memoized, with -1
+# marking an entry that must be recomputed:
+#
+#   edge_switch_memo[s, t]: the edge part for assigning t to s, which is
+#                           invalidated when a neighbor's penalties change
+#   room_switch_memo[r, t]: the room part for assigning r at t, which is
+#                           invalidated when sole_room_count[r] changes
+#
+# switch_memo_stats counts memo hits and misses. It is shared between
+# copies so the counts cover a whole search.
+#
+# penalty_totals holds the running penalty of the current assignment.
+#
+# Room updates are driven by two further structures:
+#
+#   room_sections[r]: the sections that list r as an acceptable room
+#   room_occupancy[r, t]: the number of assigned sections holding r at
+#                         a timeslot that overlaps t
+#
+# assigned_timeslot and assigned_room record the current assignment of
+# each section, or UNASSIGNED.
+#
+# A timeslot entry has the form '0 TR 11:00 am - 12:15 pm', where the
+# leading number is the label used by the course entries of the input
+class ProblemInstance(object):
+
+    def __init__(self, timeslot_list, room_list):
+
+        # Timeslots, in the order of the input list
+        self.timeslot_strings = list(timeslot_list)
+        self.timeslot_labels = [int(t[:t.index(' ')]) for t in timeslot_list]
+        self.timeslot_ids = {}
+        for i in range(len(self.timeslot_labels)):
+            self.timeslot_ids[self.timeslot_labels[i]] = i
+        self.num_timeslots = len(self.timeslot_labels)
+
+        # Rooms are interned on demand, so rooms that only appear in
+        # course entries still receive an id
+        self.room_names = []
+        self.room_ids = {}
+        self.room_sections = []
+        self.room_occupancy = np.zeros((0, self.num_timeslots), dtype = int)
+        self.sole_room_count = np.zeros((0, self.num_timeslots), dtype = int)
+        self.room_switch_memo = np.zeros((0, self.num_timeslots), dtype = int)
+        for room in room_list:
+            self.intern_room(room)
+
+        # Static information about each section
+        self.section_names = []
+        self.section_ids = {}
+        self.instructors = []
+        self.is_lab = []
+        self.acceptable_timeslots = []
+        self.acceptable_rooms = []
+        self.room_masks = []
+        self.num_sections = 0
+
+        # Per-(section, timeslot) state
+        self.timeslot_mask = np.zeros((0, self.num_timeslots), dtype = bool)
+        self.conflict_penalty = np.zeros((0, self.num_timeslots))
+        self.proximity_penalty = np.zeros((0, self.num_timeslots))
+        self.unassigned_rooms = []
+        self.has_open_room = np.zeros((0, self.num_timeslots), dtype = bool)
+        self.assigned_timeslot = np.zeros(0, dtype = int)
+        self.assigned_room = np.zeros(0, dtype = int)
+        self.edge_switch_memo = np.zeros((0, self.num_timeslots), dtype = int)
+
+        self.switch_memo_stats = {'edge_hits': 0, 'edge_misses': 0,
+                                  'room_hits': 0, 'room_misses': 0}
+
+        self.penalty_totals = PenaltyTotals()
+
+    #--- Return the id of a room, adding it to the model if necessary
+    def intern_room(self, room_name):
+        if room_name not in self.room_ids:
+            self.room_ids[room_name] = len(self.room_names)
+            self.room_names.append(room_name)
+            self.room_sections.append([])
+
+            if len(self.room_names) > len(self.room_occupancy):
+                capacity = max(64, 2 * len(self.room_occupancy))
+                self.room_occupancy = grow_rows(self.room_occupancy, capacity)
+                self.sole_room_count = grow_rows(self.sole_room_count, capacity)
+                self.room_switch_memo = grow_rows(self.room_switch_memo, capacity)
+
+            self.room_switch_memo[self.room_ids[room_name]] = -1
+
+        return self.room_ids[room_name]
+
+    #--- Add a section and return its id
+    #
+    # timeslot_labels: the labels of the acceptable timeslots
+    # room_names: the names of the acceptable rooms
+    #
+    # If a section with the same name already exists, its entry is
+    # replaced, matching the behavior of the old dictionary of courses
+    def add_section(self, name, instructor, timeslot_labels, room_names):
+
+        if name not in self.section_ids:
+            self.section_ids[name] = self.num_sections
+            self.section_names.append(name)
+            self.instructors.append(None)
+            self.is_lab.append('LAB' in name)
+            self.acceptable_timeslots.append(None)
+            self.acceptable_rooms.append([])
+            self.room_masks.append(0)
+
+            self.unassigned_rooms.extend([0] * self.num_timeslots)
+
+            # Double the capacity of the state arrays when they fill up
+            if self.num_sections == len(self.conflict_penalty):
+                capacity = max(64, 2 * self.num_sections)
+                self.timeslot_mask = grow_rows(self.timeslot_mask, capacity)
+                self.conflict_penalty = grow_rows(self.conflict_penalty, capacity)
+                self.proximity_penalty = grow_rows(self.proximity_penalty, capacity)
+                self.edge_switch_memo = grow_rows(self.edge_switch_memo, capacity)
+                self.has_open_room = grow_rows(self.has_open_room, capacity)
+                self.assigned_timeslot = grow_rows(self.assigned_timeslot, capacity)
+                self.assigned_room = grow_rows(self.assigned_room, capacity)
+
+            self.assigned_timeslot[self.num_sections] = UNASSIGNED
+            self.assigned_room[self.num_sections] = UNASSIGNED
+            self.num_sections += 1
+
+        section = self.section_ids[name]
+        self.instructors[section] = instructor
+
+        timeslots = [self.timeslot_ids[label] for label in timeslot_labels]
+        rooms = [self.intern_room(r) for r in room_names]
+
+        for r in self.acceptable_rooms[section]:
+            self.room_sections[r].remove(section)
+        for r in rooms:
+            self.room_sections[r].append(section)
+
+        self.acceptable_timeslots[section] = timeslots
+        self.acceptable_rooms[section] = rooms
+        self.room_masks[section] = room_mask(rooms)
+
+        # Every acceptable timeslot starts with all acceptable rooms open
+        # and no penalties
+        self.timeslot_mask[section] = False
+        self.timeslot_mask[section, timeslots] = True
+        self.conflict_penalty[section] = 0.0
+        self.proximity_penalty[section] = 0.0
+        self.edge_switch_memo[section] = -1
+
+        for t in range(self.num_timeslots):
+            self.set_open_rooms(section, t, 0)
+
+        for t in timeslots:
+            self.set_open_rooms(section, t, self.room_masks[section])
+
+        return section
+
+    #--- Set the mask of open rooms of a section at a timeslot
+    def set_open_rooms(self, section, timeslot, mask):
+        index = section * self.num_timeslots + timeslot
+        old_mask = self.unassigned_rooms[index]
+
+        if mask == old_mask:
+            return
+
+        # A mask with a single bit set leaves the section only one room
+        if old_mask and not old_mask & (old_mask - 1):
+            room = old_mask.bit_length() - 1
+            self.sole_room_count[room, timeslot] -= 1
+            self.room_switch_memo[room] = -1
+        if mask and not mask & (mask - 1):
+            room = mask.bit_length() - 1
+            self.sole_room_count[room, timeslot] += 1
+            self.room_switch_memo[room] = -1
+
+        self.unassigned_rooms[index] = mask
+        self.has_open_room[section, timeslot] = mask != 0
+
+    #--- Return a copy with its own state arrays
+    #
+    # The static section, timeslot, and room information is shared
+    def copy(self):
+        new_problem = copy.copy(self)
+        new_problem.conflict_penalty = self.conflict_penalty.copy()
+        new_problem.proximity_penalty = self.proximity_penalty.copy()
+        new_problem.unassigned_rooms = list(self.unassigned_rooms)
+        new_problem.has_open_room = self.has_open_room.copy()
+        new_problem.room_occupancy = self.room_occupancy.copy()
+        new_problem.sole_room_count = self.sole_room_count.copy()
+        new_problem.edge_switch_memo = self.edge_switch_memo.copy()
+        new_problem.room_switch_memo = self.room_switch_memo.copy()
+        new_problem.penalty_totals = self.penalty_totals.copy()
+        new_problem.assigned_timeslot = self.assigned_timeslot.copy()
+        new_problem.assigned_room = self.assigned_room.copy()
+
+        return new_problem
+
+    #--- Convert a solution to the name-based form used for output
+    #
+    # Returns: a dict with an entry for each section name giving the
+    # assigned timeslot label and room name, or None if unassigned
+    def named_solution(self, solution):
+        named = {}
+
+        for section in solution:
+            timeslot, room = solution[section]
 
-    remaining_timeslots = []
+            entry = {'assigned_timeslot': None, 'assigned_room': None}
+            if timeslot != UNASSIGNED:
+                entry['assigned_timeslot'] = self.timeslot_labels[timeslot]
+            if room != UNASSIGNED:
+                entry['assigned_room'] = self.room_names[room]
 
-    acceptable_timeslots = vertices[vertex]['acceptable_timeslots']
-    conflict_list = edges[vertex].keys()
+            named[self.section_names[section]] = entry
 
-    # Check every acceptable timeslot to determine if it's
-    # in a heavy or instructor conflict with an already assigned
-    # neighbor vertex
-    for slot in acceptable_timeslots:
+        return named
 
-        skip_timeslot = False
-        for conflict_course in conflict_list:
 
-            # We only care about heavy or instructor conflicts with
-            # neighbor vertices that have already been assigned
-            if conflict_course not in solution:
-                continue
+#--- Running totals of the penalty of the current assignment
+#
+# The totals are updated by update_penalties_and_room_lists in
+# O(degree) on every assignment and deallocation, so the penalty of a
+# schedule is available without rescanning the edges. Each conflicting
+# pair is counted once.
+#
+# num_unassigned counts the sections assigned the UNASSIGNED timeslot,
+# which pay UNASSIGNED_ROOM_PENALTY
+class PenaltyTotals(object):
 
-            severity = edges[vertex][conflict_course]['conflict']
-            if severity == 'L' or severity == 'M':
-                continue
+    def __init__(self):
+        self.conflict_penalty = 0
+        self.proximity_penalty = 0.0
+        self.num_conflicts = {'I': 0, 'H': 0, 'M': 0, 'L': 0}
+        self.num_unassigned = 0
 
-            solution_slot = solution[conflict_course]['assigned_timeslot']
+    def copy(self):
+        new_totals = copy.copy(self)
+        new_totals.num_conflicts = dict(self.num_conflicts)
 
-            if overlapping_timeslots[slot][solution_slot]:
-                skip_timeslot = True
+        return new_totals
 
-        # Keep track of the slots that are not in heavy conflicts
-        if not skip_timeslot:
-            remaining_timeslots.append(slot)
+    def weighted_conflict_penalty(self):
+        return CONFLICT_PENALTY_WEIGHT * self.conflict_penalty
 
-    return remaining_timeslots
+    def weighted_proximity_penalty(self):
+        return PROXIMITY_PENALTY_WEIGHT * self.proximity_penalty
 
+    def total(self):
+        return (self.weighted_conflict_penalty() + self.weighted_proximity_penalty()
+                + self.num_unassigned * UNASSIGNED_ROOM_PENALTY)
 
-#--- Selects the name of the next vertex
+    #--- Print the penalty breakdown
+    def report(self):
+        conflict_penalty = self.conflict_penalty
+        proximity_penalty = self.proximity_penalty
+        adjusted_conflict_penalty = self.weighted_conflict_penalty()
+        adjusted_proximity_penalty = self.weighted_proximity_penalty()
+        num_conflicts = self.num_conflicts
+
+        print 'Unweighted total conflict penalty: ', conflict_penalty
+        print 'Unweighted total proximity penalty: ', proximity_penalty
+        print 'Unweighted total penalty: ', str(conflict_penalty + proximity_penalty)
+
+        print 'Weighted total conflict penalty: ', adjusted_conflict_penalty
+        print 'Weighted total proximity penalty: ', adjusted_proximity_penalty
+        print 'Weighted total penalty: ', str(adjusted_conflict_penalty + adjusted_proximity_penalty)
+
+        print 'Number of instructor conflicts = ', num_conflicts['I']
+        print 'Number of heavy conflicts = ', num_conflicts['H']
+        print 'Number of medium conflicts = ', num_conflicts['M']
+        print 'Number of light conflicts = ', num_conflicts['L']
+        print 'Number of unassigned rooms = ', self.num_unassigned
+
+        print (self.total(), str(conflict_penalty), str(proximity_penalty),
+            str(num_conflicts['I'] + num_conflicts['H']), str(num_conflicts['M']),
+            str(num_conflicts['L']), self.num_unassigned)
+
+
+#--- A read-only view of the rooms set in a room bitmask
+#
+# The rooms are decoded lazily, in the order of the section's
+# acceptable rooms, when the view is indexed or iterated
+class RoomList(object):
+
+    def __init__(self, mask, acceptable_rooms):
+        self.mask = mask
+        self.acceptable_rooms = acceptable_rooms
+        self.rooms = None
+
+    def decode(self):
+        if self.rooms is None:
+            mask = self.mask
+            self.rooms = [r for r in self.acceptable_rooms if (mask >> r) & 1]
+        return self.rooms
+
+    def __len__(self):
+        return popcount(self.mask)
+
+    def __contains__(self, room):
+        return room >= 0 and (self.mask >> room) & 1 == 1
+
+    def __getitem__(self, index):
+        return self.decode()[index]
+
+    def __iter__(self):
+        return iter(self.decode())
+
+    def __repr__(self):
+        return repr(self.decode())
+
+
+#--- Return the bitmask with the bits of the given room ids set
+def room_mask(rooms):
+    mask = 0
+    for r in rooms:
+        mask |= 1 << r
+    return mask
+
+
+#--- Return the number of bits set in a nonnegative integer
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+#--- Return a copy of a 2D array with its number of rows increased to
+# capacity, padding with zeros
+def grow_rows(a, capacity):
+    new_a = np.zeros((capacity,) + a.shape[1:], dtype = a.dtype)
+    new_a[:len(a)] = a
+
+    return new_a
+
+
+#--- Selects the id of the next vertex
 #
 # solution: the solution found up to this point
-# vertices: the dictionary of course information
-# edges: the dictionary of edge conflicts
+# problem: the ProblemInstance holding the course information
+# edges: the list of edge conflicts for each section
 #
-# Returns: the name of the chosen vertex
-def select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gaps):
+# Returns: the id of the chosen vertex
+def select_vertex(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
 
     # Select the vertex using the "bad value of colors"
     #
     # The BVoC for a vertex is the number of its colors that fall
     # above given threshold for either conflict or proximity penalties
 
-    keys = vertices.keys()
-
     max_bad_value_of_colors = -1
     most_troublesome_vertex = None
 
     # Loop over all vertices
-    for vertex in keys:
+    for vertex in xrange(problem.num_sections):
 
         # Skip vertices that have already been colored
         if vertex in solution:
@@ -113,7 +558,7 @@ def select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gap
 
         # Calculate the total conflict penalty across all colors at
         # the vertex
-        timeslots = vertices[vertex]['acceptable_timeslots']
+        timeslots = problem.acceptable_timeslots[vertex]
 
         # First look for any unscheduled vertices with only one acceptable
         # timeslot: these should be scheduled before anything that has
@@ -121,7 +566,7 @@ def select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gap
         #if len(timeslots) == 1:
         #    return vertex
             
-        value = bad_value_of_colors(vertex, solution, vertices, 
+        value = bad_value_of_colors(vertex, solution, problem,
                                     edges, overlapping_timeslots, timeslot_gaps)
 
         if value > max_bad_value_of_colors:
@@ -131,16 +576,101 @@ def select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gap
     return most_troublesome_vertex
 
 
+#--- Priority queue of uncolored vertices ordered by bad value of colors
+#
+# The heap holds (-value, tie, vertex) entries, so the vertex with the
+# highest value comes out first and ties go to the lowest id, exactly
+# as in select_vertex.
+#
+# If rng, a random.Random, is given, each vertex gets a fixed random
+# factor in [1, 1 + noise] applied to its value and a random tie
+# position, so the order varies from seed to seed.
+#
+# vertices lists the uncolored vertices to queue, or None for every
+# vertex not in the solution. Only the queued vertices are scored.
+#
+# The bad value of colors of a vertex only depends on its own penalty
+# and room state, so an assignment only changes the values of its
+# neighbors and of the vertices that accept its room. Those vertices
+# are marked dirty and rescored on the next pop. Heap entries whose
+# value no longer matches the current score are skipped.
+class VertexQueue(object):
+
+    def __init__(self, solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                    rng = None, noise = 0.0, vertices = None):
+        self.solution = solution
+        self.problem = problem
+        self.edges = edges
+        self.overlapping_timeslots = overlapping_timeslots
+        self.timeslot_gaps = timeslot_gaps
+
+        if vertices is None:
+            vertices = [v for v in xrange(problem.num_sections) if v not in solution]
+
+        if rng is None:
+            self.factors = dict.fromkeys(vertices, 1.0)
+            self.ties = dict((v, v) for v in vertices)
+        else:
+            self.factors = dict((v, 1.0 + noise * rng.random()) for v in vertices)
+            self.ties = dict((v, rng.random()) for v in vertices)
+
+        self.scores = {}
+        self.dirty = set()
+        self.heap = []
+
+        for vertex in vertices:
+            self.scores[vertex] = self.score(vertex)
+            self.heap.append((-self.scores[vertex], self.ties[vertex], vertex))
+
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def score(self, vertex):
+        return self.factors[vertex] * bad_value_of_colors(vertex, self.solution, self.problem,
+                                        self.edges, self.overlapping_timeslots, self.timeslot_gaps)
+
+    #--- Mark the vertices affected by assigning room to vertex
+    def assigned(self, vertex, room):
+        for neighbor in self.edges.neighbors_of(vertex).tolist():
+            if neighbor in self.scores:
+                self.dirty.add(neighbor)
+
+        if room != UNASSIGNED:
+            for v in self.problem.room_sections[room]:
+                if v in self.scores:
+                    self.dirty.add(v)
+
+    #--- Remove and return the most troublesome vertex, or None if the
+    # queue is empty
+    def pop(self):
+        for vertex in self.dirty:
+            value = self.score(vertex)
+            if value != self.scores[vertex]:
+                self.scores[vertex] = value
+                heapq.heappush(self.heap, (-value, self.ties[vertex], vertex))
+        self.dirty.clear()
+
+        while self.heap:
+            value, tie, vertex = heapq.heappop(self.heap)
+            if self.scores.get(vertex) == -value:
+                del self.scores[vertex]
+                return vertex
+
+        return None
+
+
 #--- Calculate the conflict penalty increase that would be incurred if
 # the given timeslot is assigned to the given vertex
 #
 # Returns: the increase in conflict penalty
-def conflict_penalty_increase(vertex, timeslot, vertices):
+def conflict_penalty_increase(vertex, timeslot, problem):
     
-    if timeslot == None:
+    if timeslot == UNASSIGNED:
         return 0.0
     else:
-        return vertices[vertex][timeslot]['conflict_penalty']
+        return problem.conflict_penalty[vertex, timeslot]
 
     # Get the list of conflicting vertices
     #conflict_list = edges[vertex].keys()
@@ -177,13 +707,13 @@ def conflict_penalty_increase(vertex, timeslot, vertices):
     #return conflict_penalty
 
 
-def proximity_penalty_increase(vertex, timeslot, vertices):
+def proximity_penalty_increase(vertex, timeslot, problem):
 #def proximity_penalty_increase(vertex, timeslot, vertices):
 
-    if timeslot == None:
+    if timeslot == UNASSIGNED:
         return 0.0
     else:
-        return vertices[vertex][timeslot]['proximity_penalty']
+        return problem.proximity_penalty[vertex, timeslot]
 
     # Get the list of conflicting vertices
     #conflict_list = edges[vertex].keys()
@@ -216,346 +746,209 @@ def proximity_penalty_increase(vertex, timeslot, vertices):
 # It returns the number of colors at each vertex that switch from
 # "good" to "bad" defined by either penalty crossing a threshold
 # or the color losing all its remaining rooms
-def good_to_bad_switch_value(vertex, timeslot, room, vertices, edges,
+def good_to_bad_switch_value(vertex, timeslot, room, problem, edges,
                             overlapping_timeslots, timeslot_gaps):
     
-    switched_colors = 0
-    
-    # Consider all the vertices connected by an edge
-    for v in edges[vertex]:
-        
-        for t in vertices[v]['acceptable_timeslots']:
-            
-            if overlapping_timeslots[timeslot][t]:
-                severity = edges[vertex][v]['conflict']
-                
-                conflict = vertices[v][t]['conflict_penalty']
-                
-                if conflict > CONFLICT_PENALTY_THRESHOLD:
-                    continue
-                
-                if severity == 'H' or severity == 'I':
-                    conflict += HEAVY_CONFLICT_PENALTY
-                elif severity == 'M':
-                    conflict += MEDIUM_CONFLICT_PENALTY
-                elif severity == 'L':
-                    conflict += LIGHT_CONFLICT_PENALTY
-                    
-                if conflict > CONFLICT_PENALTY_THRESHOLD:
-                    switched_colors += 1
-                
-        proximity = vertices[v][t]['proximity_penalty']
-        
-        if proximity > PROXIMITY_PENALTY_THRESHOLD:
-            continue
-            
-        gap = timeslot_gaps[timeslot][t]
-        overlap_factor = edges[vertex][v]['overlap']
-        proximity +=  (float(gap)) * overlap_factor
-        
-        if proximity > PROXIMITY_PENALTY_THRESHOLD:
-            switched_colors += 1
-            
-    # Consider all vertices that might lose a room assignment if
-    # (timeslot, room) is assigned to vertex
-    for v in vertices:
-        if room not in vertices[v]['acceptable_rooms']:
-            continue
-            
-        for t in vertices[v]['acceptable_timeslots']:
-            
-            # If the timeslots overlap and room is the only remaining
-            # choice at t, then the assignment would remove t's only
-            # room option, making it a bad color
-            if (overlapping_timeslots[timeslot][t]
-                and vertices[v][t]['unassigned_rooms'] == [room]):
-                
-                switched_colors += 1
-                
-    return switched_colors
-    
-
-def select_color_and_room(vertex, vertices, edges, solution, overlapping_timeslots, timeslot_gaps):
-    
-    timeslot_list = vertices[vertex]['acceptable_timeslots']
-
-    best_timeslot = None
-    best_room = None
-    max_linear_combo_score = 10e8
-    
-    results = []
-    
-    for timeslot in timeslot_list:
-        
-        best_timeslot_score = 10e8
-        best_timeslot_room = None
-        
-        room_list = get_available_rooms(vertex, timeslot, solution, vertices,
-                                                    overlapping_timeslots)
-                                                    
-        if len(room_list) == 0:
-            continue
-            
-        conflict_penalty = conflict_penalty_increase(vertex, timeslot, vertices)
-
-        proximity_penalty = proximity_penalty_increase(vertex, timeslot, vertices)
-
-        total_penalty = (CONFLICT_PENALTY_WEIGHT * conflict_penalty +
-                                PROXIMITY_PENALTY_WEIGHT * proximity_penalty)
-                                
-        for room in room_list:
-            
-            good_to_bad_switch = good_to_bad_switch_value(vertex, timeslot, 
-                                            room, vertices, edges, overlapping_timeslots,
-                                            timeslot_gaps)
-            
-            linear_combo_score = (LINEAR_COMBO_CONFLICT * conflict_penalty 
-                                + LINEAR_COMBO_PROXIMITY * proximity_penalty
-                                + LINEAR_COMBO_GOOD_TO_BAD_SWITCH * good_to_bad_switch)
-                                                                                        
-            if linear_combo_score < max_linear_combo_score:
-                max_linear_combo_score = linear_combo_score
-                best_timeslot = timeslot
-                best_room = room
-                total_penalty_of_best_solution = total_penalty
-            
-            if linear_combo_score < best_timeslot_score:
-                best_timeslot_score = linear_combo_score
-                best_timeslot_room = room
-                
-        results.append((best_timeslot_score, timeslot, best_timeslot_room))
-
-    if NUM_COLORS_PER_VERTEX == 1 or USE_ONE_PASS:
-        results = [(0.0, best_timeslot, best_room)]
-    elif len(results) == 0:
-        results = [(0.0, None, None)]
-    else:        
-        results = heapq.nsmallest(NUM_COLORS_PER_VERTEX, results)
-            
-    return results
-    
-    
-#--- Select the color and room simultaneously
-def select_color_and_room_old(vertex, vertices, edges, solution, overlapping_timeslots, timeslot_gaps):
-
-    # Get the list of potential timeslots that could be assigned to the
-    # vertex
-    timeslot_list = vertices[vertex]['acceptable_timeslots']
-
-    best_timeslot = None
-    best_room = None
-    max_linear_combo_score = -10e8
-    total_penalty_of_best_solution = 10e8
-
-    room_cache = {}
-    
-    results = []
-
-    for timeslot in timeslot_list:
-        
-        best_timeslot_score = -10e8
-        best_timeslot_room = None
-
-        # Get the list of acceptable rooms that are still open at this timeslot
-        room_list = get_available_rooms(vertex, timeslot, solution, vertices,
-                                            overlapping_timeslots)
-
-        if len(room_list) == 0:
-            continue
-
-        conflict_penalty = conflict_penalty_increase(vertex, timeslot, vertices)
+    # Colors of neighbors pushed over a penalty threshold
+    switched_colors = cached_edge_switch_values(vertex, [timeslot], problem, edges,
+                                                overlapping_timeslots, timeslot_gaps)[0]
 
-        proximity_penalty = proximity_penalty_increase(vertex, timeslot, vertices)
+    # Colors of other vertices that would lose their last room
+    switched_colors += cached_room_switch_values([room], [timeslot], problem,
+                                                overlapping_timeslots)[0, 0]
 
-        total_penalty = (CONFLICT_PENALTY_WEIGHT * conflict_penalty +
-                            PROXIMITY_PENALTY_WEIGHT * proximity_penalty)
+    return int(switched_colors)
 
-        # Calculate the probability of avoiding a heavy conflict in
-        # the future if we select this timeslot
-        #
-        # Consider every connected vertex that has a heavy or instructor
-        # conflict and find the fraction of its remaining acceptable
-        # timeslots that *do not* conflict with the proposed color
-        #
-        # The total estimated prob. of avoiding a future conflict is
-        # the product of the probabilities for all such connected
-        # vertices
 
-        conflict_list = edges[vertex].keys()
-
-        prob_of_avoiding_conflict = 1.0
-        
-        good_to_bad_switch = 0
+#--- Return the edge part of the good to bad switch value for each of
+# the given timeslots, using the memo table where possible
+def cached_edge_switch_values(vertex, timeslots, problem, edges, overlapping_timeslots,
+                                timeslot_gaps):
 
-        for c in conflict_list:
+    stats = problem.switch_memo_stats
+    values = problem.edge_switch_memo[vertex, timeslots]
+    num_missing = np.count_nonzero(values < 0)
 
-            # If the edge is not 'H' or 'I', skip it
-            severity = edges[vertex][c]['conflict']
-            if severity == 'L' or severity == 'M':
-                continue
+    stats['edge_hits'] += len(timeslots) - num_missing
+    stats['edge_misses'] += num_missing
 
-            # If c has already been scheduled, check if it's in an
-            # overlapping timeslot. If so, the probability the color
-            # avoiding a conflict must be 0.0
-            if c in solution:
-                conflict_color = solution[c]['assigned_timeslot']
+    # Entries are invalidated a whole vertex at a time, so recompute
+    # them all together
+    if num_missing > 0:
+        values = edge_switch_values(vertex, timeslots, problem, edges,
+                                    overlapping_timeslots, timeslot_gaps)
+        problem.edge_switch_memo[vertex, timeslots] = values
 
-                if overlapping_timeslots[timeslot][conflict_color]:
-                    prob_of_avoiding_conflict = 0.0
-                    break
+    return values
 
-            # Calculate the fraction of remaining acceptable timeslots
-            # for course c that do not overlap with the proposed color
-            c_slot_list = vertices[c]['acceptable_timeslots']
-            c_conflict_list = edges[c].keys()
 
-            num_remaining_timeslots = len(c_slot_list)
-            num_nonconflicting_timeslots = 0
+#--- Return the room part of the good to bad switch value for each of
+# the given (timeslot, room) pairs, using the memo table where possible
+def cached_room_switch_values(rooms, timeslots, problem, overlapping_timeslots):
 
-            for c_slot in c_slot_list:
+    stats = problem.switch_memo_stats
+    values = problem.room_switch_memo[np.ix_(rooms, timeslots)].T
+    missing = values < 0
+    num_missing = np.count_nonzero(missing)
 
-                # If the slot is already in conflict with another course
-                # don't consider it
-                skip_timeslot = False
-                for c_conflict_course in c_conflict_list:
-                    if c_conflict_course not in solution:
-                        continue
+    stats['room_hits'] += values.size - num_missing
+    stats['room_misses'] += num_missing
 
-                    severity = edges[c][c_conflict_course]['conflict']
-                    if severity == 'L' or severity == 'M':
-                        continue
+    if num_missing > 0:
+        stale_rooms = [rooms[j] for j in range(len(rooms)) if missing[:, j].any()]
+        problem.room_switch_memo[np.ix_(stale_rooms, timeslots)] = \
+            room_switch_values(stale_rooms, timeslots, problem, overlapping_timeslots).T
+        values = problem.room_switch_memo[np.ix_(rooms, timeslots)].T
 
-                    solution_slot = solution[c_conflict_course]['assigned_timeslot']
+    return values
 
-                    if overlapping_timeslots[c_slot][solution_slot]:
-                        skip_timeslot = True
 
-                if skip_timeslot:
-                    num_remaining_timeslots -= 1
-                    continue
+#--- Vectorised form of the edge part of the good to bad switch value
+#
+# Returns: an array giving, for each of the given timeslots, the number
+# of neighbor colors that switch from good to bad if the timeslot is
+# assigned to vertex
+def edge_switch_values(vertex, timeslots, problem, edges, overlapping_timeslots,
+                        timeslot_gaps):
+
+    num_timeslots = problem.num_timeslots
+    switched_colors = np.zeros(len(timeslots), dtype = int)
+
+    # Neighbors without acceptable timeslots have no colors to switch
+    neighbors = []
+    edge_ids = []
+    last_timeslots = []
+
+    for v, e in zip(edges.neighbors_of(vertex).tolist(), edges.edges_of(vertex).tolist()):
+        if len(problem.acceptable_timeslots[v]) > 0:
+            neighbors.append(v)
+            edge_ids.append(e)
+            last_timeslots.append(problem.acceptable_timeslots[v][-1])
+
+    if len(neighbors) == 0:
+        return switched_colors
+
+    conflict_increases = edges.conflict_weights[edge_ids][:, np.newaxis]
+    overlap_factors = edges.overlaps[edge_ids]
+
+    # Neighbor colors pushed over the conflict threshold by any
+    # overlapping assignment
+    conflict = problem.conflict_penalty[neighbors]
+    switching = (problem.timeslot_mask[neighbors]
+                    & (conflict <= CONFLICT_PENALTY_THRESHOLD)
+                    & (conflict + conflict_increases > CONFLICT_PENALTY_THRESHOLD))
+
+    overlap_rows = overlapping_timeslots[timeslots, :num_timeslots]
+    switched_colors += np.dot(overlap_rows, switching.sum(axis = 0))
+
+    # The proximity test only looks at the last acceptable timeslot of
+    # each neighbor, as the original per-pair loop did
+    proximity = problem.proximity_penalty[neighbors, last_timeslots]
+    gaps = timeslot_gaps[np.ix_(timeslots, last_timeslots)]
+    switching = ((proximity <= PROXIMITY_PENALTY_THRESHOLD)
+                    & (proximity + gaps * overlap_factors > PROXIMITY_PENALTY_THRESHOLD))
+    switched_colors += switching.sum(axis = 1)
 
-                if not overlapping_timeslots[c_slot][timeslot]:
-                    num_nonconflicting_timeslots += 1
+    return switched_colors
 
-            if num_remaining_timeslots > 0:
-                prob_of_avoiding_conflict *= float(num_nonconflicting_timeslots) / num_remaining_timeslots
-                
-            good_to_bad_switch += num_remaining_timeslots - num_nonconflicting_timeslots
 
-        candidate_solution = copy.deepcopy(solution)
-        candidate_solution[vertex] = {}
-        candidate_solution[vertex]['assigned_timeslot'] = timeslot
+#--- Vectorised form of the room part of the good to bad switch value
+#
+# Returns: a (timeslots x rooms) array giving the number of colors that
+# lose their last room if the room is assigned at the timeslot
+def room_switch_values(rooms, timeslots, problem, overlapping_timeslots):
 
-        prob_of_avoiding_edge_conflict = prob_of_avoiding_conflict
+    num_timeslots = problem.num_timeslots
+    overlap_rows = overlapping_timeslots[timeslots, :num_timeslots].astype(int)
 
-        # Consider all rooms that can be assigned at this timeslot
-        for room in room_list:  
+    return np.dot(overlap_rows, problem.sole_room_count[rooms].T)
+    
 
-            prob_of_avoiding_room_conflict = 1.0
-            good_to_bad_switch_rooms = 0
+#--- Choose the (timeslot, room) pair for a vertex
+#
+# If rng, a random.Random, is given and top_k is more than 1, the pair
+# used by the one-pass solver is sampled uniformly from the top_k best
+# scoring candidates instead of always being the best one
+def select_color_and_room(vertex, problem, edges, solution, overlapping_timeslots, timeslot_gaps,
+                            rng = None, top_k = 1):
+    
+    timeslot_list = problem.acceptable_timeslots[vertex]
+    room_list = problem.acceptable_rooms[vertex]
 
-            # Construct the set of unscheduled courses that also have this
-            # room as one of their suitable choices
-            possible_conflicting_courses = []
-            for course in vertices:
-                if (course not in solution and
-                    room in vertices[course]['acceptable_rooms'] and
-                    course != vertex):
+    best_timeslot = UNASSIGNED
+    best_room = UNASSIGNED
+    
+    results = []
 
-                    possible_conflicting_courses.append(course)
+    if len(timeslot_list) > 0 and len(room_list) > 0:
+        scores = candidate_scores(vertex, timeslot_list, room_list, problem, edges,
+                                    overlapping_timeslots, timeslot_gaps)
 
-            # Construct a candidate schedule that makes the color and
-            # room assignment
-            candidate_solution[vertex]['assigned_room'] = room
+        # Ties go to the first candidate in (timeslot, room) order
+        for i in range(len(timeslot_list)):
+            j = np.argmin(scores[i])
+            if scores[i, j] < np.inf:
+                results.append((float(scores[i, j]), timeslot_list[i], room_list[j]))
 
-            # For each conflicting course, figure out the number of scheduling
-            # options it has using the new candidate schedule
-            for possible_conflict in possible_conflicting_courses:
+        i, j = np.unravel_index(np.argmin(scores), scores.shape)
 
-                # Number of remaining timeslots
-                remaining_timeslots = get_remaining_timeslots(possible_conflict,
-                                    solution, vertices, edges, overlapping_timeslots)
+        if rng is not None and top_k > 1:
+            candidates = np.argsort(scores, axis = None, kind = 'mergesort')[:top_k]
+            candidates = candidates[scores.flat[candidates] < 10e8]
+            if len(candidates) > 0:
+                i, j = np.unravel_index(candidates[rng.randrange(len(candidates))], scores.shape)
 
-                # Calculate the total number of "scheduling opportunities"
-                # (timeslots * rooms) that the course could have before
-                # and after assigning the (timeslot, room) combination
-                num_sched_opps_before_assignment = 0
-                num_sched_opps_after_assignment = 0
-                num_non_overlaps = 0
+        if scores[i, j] < 10e8:
+            best_timeslot = timeslot_list[i]
+            best_room = room_list[j]
 
-                for s in remaining_timeslots:
+    if NUM_COLORS_PER_VERTEX == 1 or USE_ONE_PASS:
+        results = [(0.0, best_timeslot, best_room)]
+    elif len(results) == 0:
+        results = [(0.0, UNASSIGNED, UNASSIGNED)]
+    else:        
+        results = heapq.nsmallest(NUM_COLORS_PER_VERTEX, results)
+            
+    return results
+    
+    
+#--- Calculate the linear combination score of every (timeslot, room)
+# candidate of a vertex
+#
+# Returns: a (timeslots x rooms) array of scores, with np.inf for rooms
+# that are not open at the timeslot
+def candidate_scores(vertex, timeslots, rooms, problem, edges, overlapping_timeslots,
+                        timeslot_gaps):
 
-                    if not overlapping_timeslots[s][timeslot]:
-                        num_non_overlaps += 1
-                        continue
+    base = vertex * problem.num_timeslots
 
-                    # Get the number of rooms available at this timeslot
-                    # before the assignment
-                    rooms_at_this_time_before_assignment = get_available_rooms(possible_conflict,
-                                        s, solution, vertices, overlapping_timeslots)
+    conflict_penalty = problem.conflict_penalty[vertex, timeslots]
+    proximity_penalty = problem.proximity_penalty[vertex, timeslots]
 
-                    num_sched_opps_before_assignment += len(rooms_at_this_time_before_assignment)
+    good_to_bad_switch = (cached_edge_switch_values(vertex, timeslots, problem, edges,
+                                                overlapping_timeslots, timeslot_gaps)[:, np.newaxis]
+                            + cached_room_switch_values(rooms, timeslots, problem,
+                                                overlapping_timeslots))
 
-                    # Get the number of rooms available at this time
-                    # after the assignment
-                    #rooms_at_this_time_after_assignment = get_available_rooms(possible_conflict,
-                    #                    s, candidate_solution, vertices, overlapping_timeslots)
-                    
-                    rooms_at_this_time_after_assignment = filter(lambda x: x != room, rooms_at_this_time_before_assignment)
+    scores = ((LINEAR_COMBO_CONFLICT * conflict_penalty
+                + LINEAR_COMBO_PROXIMITY * proximity_penalty)[:, np.newaxis]
+                + LINEAR_COMBO_GOOD_TO_BAD_SWITCH * good_to_bad_switch)
 
-                    num_sched_opps_after_assignment += len(rooms_at_this_time_after_assignment)
+    for i in range(len(timeslots)):
+        mask = problem.unassigned_rooms[base + timeslots[i]]
+        for j in range(len(rooms)):
+            if not (mask >> rooms[j]) & 1:
+                scores[i, j] = np.inf
 
-                if num_non_overlaps == len(remaining_timeslots):
-                    prob_of_avoiding_room_conflict *= 1.0
-                elif num_sched_opps_before_assignment == 0:
-                    prob_of_avoiding_room_conflict = 0.0
-                else:
-                    prob_of_avoiding_room_conflict *= (float(num_sched_opps_after_assignment) /
-                                                        num_sched_opps_before_assignment)
-                                                        
-                good_to_bad_switch_rooms += num_sched_opps_before_assignment - num_sched_opps_after_assignment
-
-            #prob_of_avoiding_conflict = prob_of_avoiding_edge_conflict * prob_of_avoiding_room_conflict
-
-            # Compare this assignment to the best that we've found so far
-            linear_combo_score = (LINEAR_COMBO_EDGE_CONFLICT_AVOIDANCE * prob_of_avoiding_edge_conflict +
-                                        LINEAR_COMBO_ROOM_CONFLICT_AVOIDANCE * prob_of_avoiding_room_conflict -
-                                        LINEAR_COMBO_CONFLICT * conflict_penalty -
-                                        LINEAR_COMBO_PROXIMITY * proximity_penalty -
-                                        LINEAR_COMBO_GOOD_TO_BAD_SWITCH * good_to_bad_switch -
-                                        LINEAR_COMBO_GOOD_TO_BAD_ROOMS * good_to_bad_switch_rooms)
-                                        
-            #print (timeslot, room, linear_combo_score, prob_of_avoiding_edge_conflict,
-            #    prob_of_avoiding_room_conflict, conflict_penalty, proximity_penalty, good_to_bad_switch,
-            #    good_to_bad_switch_rooms)
-
-            if linear_combo_score > max_linear_combo_score:
-                max_linear_combo_score = linear_combo_score
-                best_timeslot = timeslot
-                best_room = room
-                total_penalty_of_best_solution = total_penalty
-            
-            if linear_combo_score > best_timeslot_score:
-                best_timeslot_score = linear_combo_score
-                best_timeslot_room = room
-                
-        results.append((best_timeslot_score, timeslot, best_timeslot_room))
+    return scores
 
-    if NUM_COLORS_PER_VERTEX == 1 or USE_ONE_PASS:
-        return [(0.0, best_timeslot, best_room)]
-    else:        
-        results = heapq.nlargest(NUM_COLORS_PER_VERTEX, results)
-        
-        if len(results) == 0:
-            results = [(0.0, None, None)]
-            
-        return results
 
 #--- Return the set of available rooms that are still available for a
 # vertex after it is assigned a given color
-def get_available_rooms(vertex, timeslot, solution, vertices, overlapping_timeslots):
+def get_available_rooms(vertex, timeslot, solution, problem, overlapping_timeslots):
     
-    return vertices[vertex][timeslot]['unassigned_rooms']
+    mask = problem.unassigned_rooms[vertex * problem.num_timeslots + timeslot]
+    return RoomList(mask, problem.acceptable_rooms[vertex])
 
     #acceptable_rooms = vertices[vertex]['acceptable_rooms']
     #remove_list = []
@@ -589,16 +982,193 @@ def get_available_rooms(vertex, timeslot, solution, vertices, overlapping_timesl
 #
 # The input is a string in 12-hour time format with either 'am' or 'pm'
 def convert_time(time):
-    time_fields = time.split(" ")
-    hour_minute_fields = time_fields[0].split(":")
+    return convert_time_to_minutes(time) / 60.0
+
+
+#--- Convert a time of day to minutes after midnight
+#
+# The input is either in 12-hour format with 'am' or 'pm', as in
+# '1:15 pm', or in 24-hour format, as in '13:15'
+def convert_time_to_minutes(time):
+    time_fields = time.split()
+    hour_minute_fields = time_fields[0].split(':')
     hours = int(hour_minute_fields[0])
-    fraction = int(hour_minute_fields[1]) / 60.0
+    minutes = int(hour_minute_fields[1])
+
+    if len(time_fields) > 1:
+        if 'pm' in time_fields[1].lower() and hours < 12:
+            hours += 12
+        if 'am' in time_fields[1].lower() and hours > 11:
+            hours -= 12
+
+    return 60 * hours + minutes
+
+
+#--- A timeslot string parsed once into meeting intervals
+#
+# A timeslot string has the form
+#   0 TR 11:00 am - 12:15 pm
+#
+# The leading label is optional, and times may also be written in
+# 24-hour format, as in 'MWF 14:00 - 14:50'. Custom timeslots have
+# several components, separated by ' ; ', that meet at different times
+# on different days.
+#
+# days[d] lists the (start_minute, end_minute) intervals of the meetings
+# on day d, with days numbered in the order of DAYS
+#
+# week_mask has a bit for each TIME_RESOLUTION minutes of the week, set
+# for every block touched by a meeting, so two timeslots overlap if
+# their masks share a bit. This is exact when all the times of both
+# slots fall on the TIME_RESOLUTION grid, recorded by on_grid;
+# otherwise the intervals are compared directly.
+DAYS = 'MTWRF'
+TIME_RESOLUTION = 5
+BLOCKS_PER_DAY = 24 * 60 / TIME_RESOLUTION
+
+class ParsedTimeslot(object):
+
+    def __init__(self, timeslot_string, timeslot_id = None):
+        self.id = timeslot_id
+        self.string = timeslot_string
+        self.label = None
+        self.days = [[] for d in DAYS]
+
+        fields = timeslot_string.split(' ', 1)
+        if fields[0].isdigit():
+            self.label = int(fields[0])
+            timeslot_string = fields[1]
+
+        for component in timeslot_string.split(' ; '):
+            meeting_days, times = component.strip().split(' ', 1)
+            start_time, end_time = times.split('-')
+            interval = (convert_time_to_minutes(start_time), convert_time_to_minutes(end_time))
+
+            for d in range(len(DAYS)):
+                if DAYS[d] in meeting_days:
+                    self.days[d].append(interval)
+
+        self.week_mask = 0
+        self.on_grid = True
+
+        for d in range(len(DAYS)):
+            for start, end in self.days[d]:
+                if start % TIME_RESOLUTION != 0 or end % TIME_RESOLUTION != 0:
+                    self.on_grid = False
+
+                for block in self.blocks(d, start, end):
+                    self.week_mask |= 1 << block
+
+    #--- Return the range of week_mask bits covered by a meeting
+    def blocks(self, day, start, end):
+        first = day * BLOCKS_PER_DAY + start / TIME_RESOLUTION
+        last = day * BLOCKS_PER_DAY + min(end / TIME_RESOLUTION, BLOCKS_PER_DAY - 1)
+
+        return range(first, last + 1)
+
+    #--- Return True if some day has at most one meeting
+    def has_simple_days(self):
+        return all(len(meetings) <= 1 for meetings in self.days)
+
+    #--- Return True if the timeslots meet at the same time on some day
+    #
+    # Meetings that end and start at the same minute overlap
+    def overlaps(self, other):
+        if self.on_grid and other.on_grid:
+            return (self.week_mask & other.week_mask) != 0
+
+        for d in range(len(DAYS)):
+            for start_1, end_1 in self.days[d]:
+                for start_2, end_2 in other.days[d]:
+                    if start_1 <= end_2 and start_2 <= end_1:
+                        return True
+
+        return False
+
+    #--- Return a tuple with True if the timeslots overlap and the gap
+    # between them in hours
+    #
+    # The gap adds up the time between every pair of meetings on the
+    # same day that do not overlap, ignoring gaps of at most
+    # MAX_IGNORED_GAP_WIDTH hours
+    def overlap_and_gap(self, other):
+        overlap_exists = False
+        gap = 0
+        max_ignored_gap = 60 * MAX_IGNORED_GAP_WIDTH
+
+        for d in range(len(DAYS)):
+            for start_1, end_1 in self.days[d]:
+                for start_2, end_2 in other.days[d]:
+
+                    if start_1 <= end_2 and start_2 <= end_1:
+                        overlap_exists = True
+                    else:
+                        meeting_gap = max(start_2 - end_1, start_1 - end_2)
+
+                        if meeting_gap > max_ignored_gap:
+                            gap += meeting_gap
+
+        return overlap_exists, gap / 60.0
+
+
+#--- Calculate the overlap and gap matrices of a list of parsed timeslots
+#
+# Overlaps come from a single product of the week masks. Gaps are
+# computed for all pairs at once from the first meeting of each slot on
+# each day. Slots with several meetings on one day, or with times off
+# the mask grid, are compared pair by pair.
+#
+# Returns: a boolean overlap matrix and a float gap matrix in hours
+def overlap_and_gap_matrices(parsed_timeslots):
+    num_timeslots = len(parsed_timeslots)
+    num_days = len(DAYS)
+
+    masks = np.zeros((num_timeslots, num_days * BLOCKS_PER_DAY), dtype = np.float32)
+    starts = np.zeros((num_timeslots, num_days), dtype = int)
+    ends = np.zeros((num_timeslots, num_days), dtype = int)
+    meets = np.zeros((num_timeslots, num_days), dtype = bool)
+
+    for i in range(num_timeslots):
+        slot = parsed_timeslots[i]
+
+        for d in range(num_days):
+            for start, end in slot.days[d]:
+                masks[i, slot.blocks(d, start, end)] = 1.0
+
+            if len(slot.days[d]) > 0:
+                starts[i, d], ends[i, d] = slot.days[d][0]
+                meets[i, d] = True
+
+    overlaps = np.dot(masks, masks.T) > 0
+
+    # Gaps between meetings on the same day that do not overlap
+    max_ignored_gap = 60 * MAX_IGNORED_GAP_WIDTH
+    gap_minutes = np.zeros((num_timeslots, num_timeslots), dtype = int)
 
-    if 'pm' in time_fields[1].lower() and hours < 12:
-        hours += 12
-    if 'am' in time_fields[1].lower() and hours > 11:
-        hours -= 12
-    return hours + fraction
+    for d in range(num_days):
+        start = starts[:, d]
+        end = ends[:, d]
+
+        meeting_gap = np.maximum(start[np.newaxis, :] - end[:, np.newaxis],
+                                 start[:, np.newaxis] - end[np.newaxis, :])
+        counted = (meets[:, d][:, np.newaxis] & meets[:, d][np.newaxis, :]
+                    & (meeting_gap > 0) & (meeting_gap > max_ignored_gap))
+        gap_minutes += np.where(counted, meeting_gap, 0)
+
+    # Round half up, as round does for the nonnegative gaps
+    gaps = np.floor(gap_minutes / 60.0 + 0.5)
+
+    for i in range(num_timeslots):
+        slot_1 = parsed_timeslots[i]
+        if slot_1.on_grid and slot_1.has_simple_days():
+            continue
+
+        for j in range(num_timeslots):
+            overlap_exists, gap = slot_1.overlap_and_gap(parsed_timeslots[j])
+            overlaps[i, j] = overlaps[j, i] = overlap_exists
+            gaps[i, j] = gaps[j, i] = round(gap)
+
+    return overlaps, gaps
 
 
 #--- Determines if two timeslot strings overlap
@@ -610,53 +1180,10 @@ def convert_time(time):
 # Returns: A tuple with the first element True if the slots overlap
 # and the second giving the gap distance bewteen the slots as a float
 def check_meeting_overlap_and_gap(meeting_1, meeting_2):
+    overlap_exists, gap = ParsedTimeslot(meeting_1).overlap_and_gap(ParsedTimeslot(meeting_2))
 
-    fields_1 = meeting_1.split(' ')
-    fields_2 = meeting_2.split(' ')
-
-    # Extract the meeting days
-    days_1 = fields_1[0]
-    days_2 = fields_2[0]
-
-    # Overlap is a binary property, it either exists or it doesn't
-    # If we find any days where the classes conflict, then overlap_exists
-    # is set to True and kept True
-    overlap_exists = False
-    gap = 0.0
-
-    # Check for meeting times on the same days
-    for d in 'MTWRF':
-        if d in days_1 and d in days_2:
-            
-            # Convert the times to decimal
-            start_time_1 = fields_1[1] + ' ' + fields_1[2]
-            conv_start_1 = convert_time(start_time_1)
-            end_time_1 = fields_1[4] + ' ' + fields_1[5]
-            conv_end_1 = convert_time(end_time_1)
-
-            start_time_2 = fields_2[1] + ' ' + fields_2[2]
-            conv_start_2 = convert_time(start_time_2)
-            end_time_2 = fields_2[4] + ' ' + fields_2[5]
-            conv_end_2 = convert_time(end_time_2)
-
-            # The slots overlap if either start time lies between the
-            # start and end time of the other meeting
-            if ((conv_start_1 >= conv_start_2 and conv_start_1 <= conv_end_2) or
-                (conv_start_2 >= conv_start_1 and conv_start_2 <= conv_end_1)):
-
-                overlap_exists = True
-                gap = 0.0  # Overlapping classes have a gap of 0.0
-                break
-
-            else:
-                # The gap is the distance between the start and end time
-                # If we calculate both differences, one will be positive and
-                # the other will be negative --- take the positive one as
-                # the gap value
-                this_meeting_gap = max(conv_start_2 - conv_end_1, conv_start_1 - conv_end_2)
-
-                if this_meeting_gap > MAX_IGNORED_GAP_WIDTH:
-                    gap += this_meeting_gap
+    if overlap_exists:
+        gap = 0.0
 
     return overlap_exists, gap
 
@@ -666,75 +1193,51 @@ def check_meeting_overlap_and_gap(meeting_1, meeting_2):
 # Each timeslot entry has the form
 #   0 TR 11:00 am - 12:15 pm
 #
-# The first number is the unique id of the timeslot
+# The first number is the unique id of the timeslot. Times may also be
+# given in 24-hour format.
 #
 # A timeslot may have meeting times at different hours on different
 # days --- the components of the timeslot are separated by semicolons
 #
 # Returns: a dict recording a True/False entry for each pair of timeslot IDs
 # and a dict recording gaps for each timeslot pair
-def calculate_overlapping_timeslots_and_gaps(timeslot_list):
+#
+# If as_matrices is True, the tables are instead returned as a boolean and
+# a float NumPy matrix indexed by the position of each timeslot in the list,
+# which is its id in a ProblemInstance. The extra final row and column hold
+# the entries for an UNASSIGNED timeslot, so index -1 can be used directly.
+def calculate_overlapping_timeslots_and_gaps(timeslot_list, as_matrices = False):
     are_overlapping = {}
     gaps = {}
 
-    # Loop over each entry in the timeslot list
-    for i in range(len(timeslot_list)):
-        slot_1 = timeslot_list[i]
-
-        # Extract the id number from the slot string
-        index_of_first_space = slot_1.index(' ')
-        id_1 = int(slot_1[:index_of_first_space])
-
-        # Multi-part timeslots meet at different times on different
-        # days --- each part is separated by a semicolon
-        slot_components_1 = slot_1[index_of_first_space+ 1 :].split(' ; ')
-
-        # Each timeslot id gets a dictionary storing an entry for each
-        # other timeslot id
-        are_overlapping[id_1] = {}
-        gaps[id_1] = {}
-
-        # Compare the first entry to every other entry
-        for j in range(len(timeslot_list)):
-            slot_2 = timeslot_list[j]
-
-            # Extract the id number from the slot string
-            index_of_first_space = slot_2.index(' ')
-            id_2 = int(slot_2[:index_of_first_space])
-
-            slot_components_2 = slot_2[index_of_first_space + 1 :].split(' ; ')
-
-            # Check all pairs of meeting times between the two slots
-            # to determine if there is any overlap
-            #
-            # Yes, this is a huge pain.
-
-            # Overlap is a binary property: if we find any pair of meetings
-            # that overlap, we have to treat the entire timeslots as overlapping
-            overlap_exists = False
+    num_timeslots = len(timeslot_list)
+    overlap_matrix = np.zeros((num_timeslots + 1, num_timeslots + 1), dtype = bool)
+    gap_matrix = np.zeros((num_timeslots + 1, num_timeslots + 1))
 
-            # Gap factor is a little more complicated: there might be different
-            # gaps among different meeting times on different days. Therefore,
-            # we'll report the *maximum* gap as the overall gap between the
-            # two timeslots
-            max_gap = 0.0
+    # Each timeslot string is parsed once
+    parsed_timeslots = [ParsedTimeslot(timeslot_list[i], i) for i in range(num_timeslots)]
 
-            for meeting_1 in slot_components_1:
-                for meeting_2 in slot_components_2:
+    # Overlap is a binary property: if any pair of meetings overlap, the
+    # entire timeslots are treated as overlapping. The gap adds up the
+    # gaps between the meetings on each day
+    overlap_matrix[:num_timeslots, :num_timeslots], gap_matrix[:num_timeslots, :num_timeslots] = \
+        overlap_and_gap_matrices(parsed_timeslots)
 
-                    meeting_overlap, meeting_gap = check_meeting_overlap_and_gap(meeting_1, meeting_2)
+    # The UNASSIGNED row and column of the matrices never overlap and
+    # have no gap, so they keep their initial values
+    if as_matrices:
+        return overlap_matrix, gap_matrix
 
-                    if meeting_overlap:
-                        overlap_exists = True
+    overlap_rows = overlap_matrix.tolist()
+    gap_rows = gap_matrix.tolist()
 
-                    #max_gap = max(max_gap, meeting_gap)
-                    max_gap += meeting_gap
+    for slot_1 in parsed_timeslots:
+        are_overlapping[slot_1.label] = {}
+        gaps[slot_1.label] = {}
 
-            # Once all the slot components have been compared we know
-            # if any of them overlap and the maximum gap  between any
-            # two that occur on the same day
-            are_overlapping[id_1][id_2] = overlap_exists
-            gaps[id_1][id_2] = round(max_gap)
+        for slot_2 in parsed_timeslots:
+            are_overlapping[slot_1.label][slot_2.label] = overlap_rows[slot_1.id][slot_2.id]
+            gaps[slot_1.label][slot_2.label] = gap_rows[slot_1.id][slot_2.id]
 
     # Add entries for None to both tables
     #
@@ -753,16 +1256,90 @@ def calculate_overlapping_timeslots_and_gaps(timeslot_list):
     return are_overlapping, gaps
 
 
+#--- Key identifying the overlap and gap matrices of a timeslot list
+#
+# The key hashes the parsed meeting intervals of each slot in list order,
+# so the ids and the spelling of the times in the strings do not matter,
+# together with every setting the matrices depend on
+def timeslot_cache_key(timeslot_list):
+    digest = hashlib.sha1()
+    digest.update('%d %r %d\n' % (TIMESLOT_CACHE_VERSION, float(MAX_IGNORED_GAP_WIDTH), TIME_RESOLUTION))
+
+    for timeslot_string in timeslot_list:
+        digest.update(repr(ParsedTimeslot(timeslot_string).days) + '\n')
+
+    return digest.hexdigest()
+
+
+#--- Save one matrix to the cache
+#
+# The file is written under a temporary name and renamed into place, so
+# a concurrent reader sees either nothing or the complete file
+def save_cached_matrix(path, matrix):
+    handle, temp_path = tempfile.mkstemp(dir = os.path.dirname(path), suffix = '.tmp')
+
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            np.save(f, matrix)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+#--- Overlap and gap matrices for a timeslot list, cached on disk
+#
+# timeslot_list: the timeslot strings in id order
+# cache_dir: directory holding the cached matrices, or None to disable
+#            the cache
+#
+# Returns: the same pair of matrices as
+#          calculate_overlapping_timeslots_and_gaps(..., as_matrices = True),
+#          memory-mapped read-only from the cache when a copy exists
+#
+# The matrices are stored as .npy files named by timeslot_cache_key, so
+# a changed slot list or gap width gets a new entry rather than a stale
+# one. Old entries are never removed; delete the directory to clear it.
+def cached_overlapping_timeslots_and_gaps(timeslot_list, cache_dir = TIMESLOT_CACHE_DIR):
+    if cache_dir is None:
+        return calculate_overlapping_timeslots_and_gaps(timeslot_list, as_matrices = True)
+
+    key = timeslot_cache_key(timeslot_list)
+    overlap_path = os.path.join(cache_dir, key + '.overlap.npy')
+    gap_path = os.path.join(cache_dir, key + '.gap.npy')
+
+    # The mapped files are returned as plain arrays, since indexing the
+    # np.memmap subclass goes through Python-level code
+    try:
+        return (np.asarray(np.load(overlap_path, mmap_mode = 'r')),
+                np.asarray(np.load(gap_path, mmap_mode = 'r')))
+    except (IOError, OSError, ValueError):
+        pass
+
+    overlap_matrix, gap_matrix = calculate_overlapping_timeslots_and_gaps(timeslot_list, as_matrices = True)
+
+    # A cache that cannot be written only costs the rebuild next time
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        save_cached_matrix(overlap_path, overlap_matrix)
+        save_cached_matrix(gap_path, gap_matrix)
+    except (IOError, OSError):
+        pass
+
+    return overlap_matrix, gap_matrix
+
+
 #--- Calculate the total penalty of a schedule
 #
 # solution: the solution dictionary holding the assigned timeslot
-#           for each course
-# edges: the dictionary of conflicts between courses
-# are_overlapping_timeslots: a dict that stores a True/False entry for
-#            pairs of timeslots recording whether they overlap
+#           and room for each course
+# edges: the conflict graph
+# overlapping_timeslots: a boolean matrix recording whether pairs of
+#            timeslot ids overlap
 #
 # Returns: the penalty value
-def calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, vertices):
+def calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, problem):
 
     conflict_penalty = 0
     proximity_penalty = 0
@@ -779,50 +1356,47 @@ def calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gap
     num_light_conflicts = 0
     num_unassigned_rooms = 0
 
-    for course in keys:
+    neighbors = edges.neighbors.tolist()
+    edge_ids = edges.edge_ids.tolist()
+    offsets = edges.offsets.tolist()
 
-        slot_1 = solution[course]['assigned_timeslot']
+    for course in keys:
 
-        # Get the list of conflicting edges
-        conflict_list = edges[course].keys()
+        slot_1 = solution[course][0]
 
         course_proximity_penalty = 0.0
         
-        if slot_1 == None:
+        if slot_1 == UNASSIGNED:
             num_unassigned_rooms += 1
             continue
 
         # Examine the possible conflicts and check for overlapping
         # timeslot assignments
-        for c in conflict_list:
+        for i in xrange(offsets[course], offsets[course + 1]):
             
+            c = neighbors[i]
+            edge = edge_ids[i]
+
             if c not in solution:
                 continue
 
-            slot_2 = solution[c]['assigned_timeslot']
+            slot_2 = solution[c][0]
             
-            if slot_2 == None:
+            if slot_2 == UNASSIGNED:
                 continue
 
             # If the timeslots overlap, pay the conflict penalty
-            if overlapping_timeslots[slot_1][slot_2]:
-                conflict_severity = edges[course][c]['conflict']
+            if overlapping_timeslots[slot_1, slot_2]:
+                conflict_severity = edges.severities[edge]
+                conflict_penalty += int(edges.conflict_weights[edge])
 
                 if conflict_severity == 'I':
-                    #print 'instructor: ', course, c
-                    conflict_penalty += INSTRUCTOR_CONFLICT_PENALTY
                     num_instructor_conflicts += 1
                 elif conflict_severity == 'H':
-                    #print 'heavy: ', course, c
-                    conflict_penalty += HEAVY_CONFLICT_PENALTY
                     num_heavy_conflicts += 1
                 elif conflict_severity == 'M':
-                    #print 'medium: ', course, c
-                    conflict_penalty += MEDIUM_CONFLICT_PENALTY
                     num_medium_conflicts += 1
                 elif conflict_severity == 'L':
-                    #print 'light: ', course, c
-                    conflict_penalty += LIGHT_CONFLICT_PENALTY
                     num_light_conflicts += 1
 
             # Calculate the gap between the courses and pay the
@@ -844,8 +1418,8 @@ def calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gap
             # compact schedules for instructors
             #
             # The gap must be at least GAP_WIDTH to incur any penalty
-            gap = timeslot_gaps[slot_1][slot_2]
-            overlap_factor = edges[course][c]['overlap']
+            gap = timeslot_gaps[slot_1, slot_2]
+            overlap_factor = int(edges.overlaps[edge])
             course_proximity_penalty += (float(gap)) * overlap_factor
             proximity_penalty +=  (float(gap)) * overlap_factor
 
@@ -880,64 +1454,230 @@ def calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gap
             str(num_light_conflicts / 2), num_unassigned_rooms)
 
     return total_penalty
-    
-    
-def update_penalties_and_room_lists(vertex, timeslot, room, vertices, solution,
-                                        edges, overlapping_timeslots, timeslot_gaps, deallocate = False):
-                                                                                
-    # Update the unassigned rooms and penalties for vertices
-    # affected by the assignment
-    for v in edges[vertex]:
-        severity = edges[vertex][v]['conflict']
-        
-        if severity == 'H':
-            conflict_increase = HEAVY_CONFLICT_PENALTY
-        elif severity  == 'I':
-            conflict_increase = INSTRUCTOR_CONFLICT_PENALTY
-        elif severity  == 'M':
-            conflict_increase = MEDIUM_CONFLICT_PENALTY
-        elif severity  == 'L':
-            conflict_increase = LIGHT_CONFLICT_PENALTY
-        
-        # Update the penalties for overlapping timeslots 
-        for neighbor_slot in vertices[v]['acceptable_timeslots']:
-            if overlapping_timeslots[timeslot][neighbor_slot]:
-                if deallocate:
-                    vertices[v][neighbor_slot]['conflict_penalty'] -= conflict_increase
-                else:
-                    vertices[v][neighbor_slot]['conflict_penalty'] += conflict_increase
-                
-            # The change in proximity penalty incurred by assigning
-            # timeslot to vertex
-            gap = timeslot_gaps[timeslot][neighbor_slot]
-            overlap_factor = edges[vertex][v]['overlap']
-            proximity_increase =  (float(gap)) * overlap_factor
-            
-            if deallocate:
-                vertices[v][neighbor_slot]['proximity_penalty'] -= proximity_increase
-            else:
-                vertices[v][neighbor_slot]['proximity_penalty'] += proximity_increase
 
-    # Update room availability    
-    for v in vertices:
-        
-        if v == vertex:
-            continue
+
+#--- Return the penalty of a schedule from the running totals
+#
+# If CHECK_PENALTY_TOTALS is set, the penalty is also recomputed with
+# calculate_total_penalty and any difference is reported
+def running_total_penalty(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
+
+    penalty = problem.penalty_totals.total()
+
+    if CHECK_PENALTY_TOTALS:
+        expected = calculate_total_penalty(solution, edges, overlapping_timeslots,
+                                            timeslot_gaps, problem)
+        if expected != penalty:
+            print 'Penalty totals out of sync: ', penalty, expected
+
+    return penalty
+
+
+#--- Update the running penalty totals for assigning timeslot to vertex
+#
+# sign is 1 for an assignment and -1 to deallocate a previous assignment
+def update_penalty_totals(vertex, timeslot, problem, edges, overlapping_timeslots,
+                            timeslot_gaps, sign = 1):
+
+    totals = problem.penalty_totals
+
+    if timeslot == UNASSIGNED:
+        totals.num_unassigned += sign
+        return
+
+    # Unassigned neighbors index the UNASSIGNED row of the matrices,
+    # which has no overlaps or gaps
+    neighbors = edges.neighbors_of(vertex)
+    edge_ids = edges.edges_of(vertex)
+    timeslots = problem.assigned_timeslot[neighbors]
+
+    conflicts = edge_ids[overlapping_timeslots[timeslot, timeslots]]
+    severities = edges.severities[conflicts]
+
+    totals.conflict_penalty += sign * int(edges.conflict_weights[conflicts].sum())
+    for severity in totals.num_conflicts:
+        totals.num_conflicts[severity] += sign * int(np.count_nonzero(severities == severity))
+
+    totals.proximity_penalty += sign * float(np.dot(timeslot_gaps[timeslot, timeslots],
+                                                    edges.overlaps[edge_ids]))
+    
+    
+#--- Apply the penalty changes caused by assigning timeslot to vertex
+#
+# Every neighbor of vertex has its whole row of the conflict and
+# proximity penalty arrays updated at once:
+#
+#   conflict_penalty[v] += severity weight * overlap row of timeslot
+#   proximity_penalty[v] += overlap factor * gap row of timeslot
+#
+# with both rows masked by the acceptable timeslots of v
+#
+# sign is 1 for an assignment and -1 to deallocate a previous assignment
+def update_penalties(vertex, timeslot, problem, edges, overlapping_timeslots,
+                        timeslot_gaps, sign = 1):
+
+    num_timeslots = problem.num_timeslots
+
+    neighbors = edges.neighbors_of(vertex)
+
+    if len(neighbors) == 0:
+        return
+
+    edge_ids = edges.edges_of(vertex)
+    conflict_increases = sign * edges.conflict_weights[edge_ids]
+    overlap_factors = sign * edges.overlaps[edge_ids]
+
+    mask = problem.timeslot_mask[neighbors]
+
+    # Overlaps and gaps between the assigned timeslot and all others
+    overlap_row = overlapping_timeslots[timeslot, :num_timeslots]
+    gap_row = timeslot_gaps[timeslot, :num_timeslots]
+
+    conflict_rows = np.outer(conflict_increases, overlap_row)
+    proximity_rows = np.outer(overlap_factors, gap_row)
+
+    problem.conflict_penalty[neighbors] += conflict_rows * mask
+    problem.proximity_penalty[neighbors] += proximity_rows * mask
+
+    # The edge part of the switch value of a vertex depends on the
+    # penalties of its neighbors
+    stale = [edges.neighbors_of(v) for v in neighbors.tolist()]
+    problem.edge_switch_memo[np.concatenate(stale)] = -1
+
+
+def update_penalties_and_room_lists(vertex, timeslot, room, problem, solution,
+                                        edges, overlapping_timeslots, timeslot_gaps, deallocate = False):
+                                                                                
+    num_timeslots = problem.num_timeslots
+
+    # Update the penalties for vertices affected by the assignment
+    if deallocate:
+        # Release the room actually held by the vertex, which may differ
+        # from the room recorded in a solution built without rooms
+        room = int(problem.assigned_room[vertex])
+
+        update_penalties(vertex, timeslot, problem, edges, overlapping_timeslots,
+                            timeslot_gaps, sign = -1)
+        update_penalty_totals(vertex, timeslot, problem, edges, overlapping_timeslots,
+                                timeslot_gaps, sign = -1)
+        problem.assigned_timeslot[vertex] = UNASSIGNED
+        problem.assigned_room[vertex] = UNASSIGNED
+    else:
+        update_penalties(vertex, timeslot, problem, edges, overlapping_timeslots,
+                            timeslot_gaps)
+        update_penalty_totals(vertex, timeslot, problem, edges, overlapping_timeslots,
+                                timeslot_gaps)
+        problem.assigned_timeslot[vertex] = timeslot
+        problem.assigned_room[vertex] = room
+
+    if room == UNASSIGNED:
+        return problem
+
+    # Update the occupancy of the room at every timeslot overlapping
+    # the assigned one
+    overlap_row = overlapping_timeslots[timeslot]
+
+    if deallocate:
+        problem.room_occupancy[room] -= overlap_row[:num_timeslots]
+    else:
+        problem.room_occupancy[room] += overlap_row[:num_timeslots]
+
+    occupancy = problem.room_occupancy[room]
+    room_bit = 1 << room
+    unassigned_rooms = problem.unassigned_rooms
+
+    # Update room availability for the sections that could use the room
+    for v in problem.room_sections[room]:
         
-        if room not in vertices[v]['acceptable_rooms']:
+        if v == vertex:
             continue
         
-        for t in vertices[v]['acceptable_timeslots']:
-            if overlapping_timeslots[timeslot][t]:
-                
-                if deallocate:
-                    vertices[v][t]['unassigned_rooms'].append(room)
+        base = v * num_timeslots
+        
+        for t in problem.acceptable_timeslots[v]:
+            if not overlap_row[t]:
+                continue
 
-                else:
-                    filtered_rooms = filter(lambda x: x != room, vertices[v][t]['unassigned_rooms'])                
-                    vertices[v][t]['unassigned_rooms'] = filtered_rooms
+            if deallocate:
+
+                # The room only opens up again if no other section still
+                # holds it at an overlapping time
+                holders = occupancy[t]
+                if (problem.assigned_room[v] == room and
+                    overlapping_timeslots[problem.assigned_timeslot[v], t]):
+                    holders -= 1
+
+                if holders == 0:
+                    problem.set_open_rooms(v, t, unassigned_rooms[base + t] | room_bit)
+
+            else:
+                problem.set_open_rooms(v, t, unassigned_rooms[base + t] & ~room_bit)
                 
-    return vertices
+    return problem
+
+
+#--- Deadline and progress reporting for a solve
+#
+# deadline: a time.time() value at which the solver stops and keeps the
+#           best complete schedule it has, or None for no limit
+# on_progress: a function called with a progress event, or None. An
+#              event is a dictionary holding the 'phase' of the solve,
+#              the 'iteration' within the phase, the 'penalty' of the
+#              current schedule, the 'best_penalty' of the phase and
+#              the 'elapsed' seconds since the solve started.
+#
+# Events are sent at most every interval seconds while a phase runs,
+# and always at its end. During construction the penalty is that of the
+# partial schedule.
+class SolveMonitor(object):
+
+    def __init__(self, deadline = None, on_progress = None, interval = PROGRESS_INTERVAL):
+        self.deadline = deadline
+        self.on_progress = on_progress
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    # The smaller of a time limit and the time left before the deadline,
+    # where a time limit of None means no limit
+    def time_left(self, time_limit):
+        if self.deadline is None:
+            return time_limit
+
+        time_left = max(0.0, self.deadline - time.time())
+        if time_limit is None:
+            return time_left
+
+        return min(time_limit, time_left)
+
+    def report(self, phase, iteration, penalty, best_penalty, force = False):
+        if self.on_progress is None:
+            return
+
+        now = time.time()
+        if not force and now - self.last_report < self.interval:
+            return
+
+        self.last_report = now
+        self.on_progress({'phase': phase, 'iteration': iteration, 'penalty': penalty,
+                            'best_penalty': best_penalty, 'elapsed': now - self.start_time})
+
+
+#--- Give every section missing from a solution no timeslot, so that a
+# construction stopped at its deadline still returns a complete schedule
+def leave_unassigned(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
+
+    for vertex in xrange(problem.num_sections):
+        if vertex not in solution:
+            solution[vertex] = (UNASSIGNED, UNASSIGNED)
+            problem = update_penalties_and_room_lists(vertex, UNASSIGNED, UNASSIGNED, problem,
+                                                        solution, edges, overlapping_timeslots,
+                                                        timeslot_gaps)
+
+    return problem
 
 
 #--- Run the one-pass construction algorithm
@@ -952,39 +1692,64 @@ def update_penalties_and_room_lists(vertex, timeslot, room, vertices, solution,
 # The real strategy is in the choice of heuristics to pick the
 # "most troublesome" vertex at each step and then choose its color
 #
-# vertices: the dictionary of course information
-# edges: the dictionary of conflcting edge information
+# problem: the ProblemInstance holding the course information
+# edges: the list of conflicting edge information for each course
+# rng: a random.Random for a randomized run, or None for the
+#      deterministic solver
+# noise, top_k: the amount of randomness, as in VertexQueue and
+#               select_color_and_room
+# monitor: a SolveMonitor, or None. At its deadline the remaining
+#          sections are left without a timeslot.
+# solution: a partial solution, already assigned in problem, to
+#           complete in place, or None to start from no assignments
+# vertices: the sections missing from the partial solution, if known,
+#           so the queue does not scan every section
 #
-# Returns: a solution dictionary listing the assigned timeslot and
-# room for each course
-def one_pass_solver(vertices, edges, overlapping_timeslots, timeslot_gaps):
+# Returns: a solution dictionary mapping each course id to its
+# assigned (timeslot, room) pair
+def one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                    rng = None, noise = MULTI_START_NOISE, top_k = MULTI_START_TOP_K,
+                    monitor = None, solution = None, vertices = None):
     
-    solution = {}
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    if solution is None:
+        solution = {}
     
-    num_vertices = len(vertices)
-    num_colored_vertices = len(solution)
+    queue = VertexQueue(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                        rng = rng, noise = noise, vertices = vertices)
 
-    while num_colored_vertices < num_vertices:
+    while len(queue) > 0:
+
+        if monitor.expired():
+            problem = leave_unassigned(solution, problem, edges, overlapping_timeslots,
+                                        timeslot_gaps)
+            break
 
         # Select the "most troublesome" vertex to color
-        # Returns the name of a vertex as entered in the vertices
-        vertex = select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gaps)
+        # Returns the id of a vertex in the problem
+        vertex = queue.pop()
 
-        selection = select_color_and_room(vertex, vertices, edges, solution,
-                            overlapping_timeslots, timeslot_gaps)
+        selection = select_color_and_room(vertex, problem, edges, solution,
+                            overlapping_timeslots, timeslot_gaps, rng = rng, top_k = top_k)
                                                                                     
         color = selection[0][1]
         room = selection[0][2]
         
         # Make the assignment
-        solution[vertex] = {}
-        solution[vertex]['assigned_timeslot'] = color
-        solution[vertex]['assigned_room'] = room
+        solution[vertex] = (color, room)
         
-        vertices = update_penalties_and_room_lists(vertex, color, room, vertices, solution,
+        problem = update_penalties_and_room_lists(vertex, color, room, problem, solution,
                                                 edges, overlapping_timeslots, timeslot_gaps)
-                    
-        num_colored_vertices += 1
+
+        queue.assigned(vertex, room)
+
+        penalty = problem.penalty_totals.total()
+        monitor.report('construct', len(solution), penalty, penalty)
+
+    penalty = problem.penalty_totals.total()
+    monitor.report('construct', len(solution), penalty, penalty, force = True)
 
     return solution
     
@@ -996,13 +1761,14 @@ def one_pass_solver(vertices, edges, overlapping_timeslots, timeslot_gaps):
 #
 # If the penalty is not high enough to exceed the threshold, the color
 # is assigned a partial badness value
-def bad_value_of_colors(vertex, solution, vertices, edges, overlapping_timeslots, timeslot_gaps):
+def bad_value_of_colors(vertex, solution, problem, edges, overlapping_timeslots, timeslot_gaps):
         
     bad_value_of_colors = 0.0
     
     # Calculate the total conflict penalty across all colors at
     # the vertex
-    timeslots = vertices[vertex]['acceptable_timeslots']
+    timeslots = problem.acceptable_timeslots[vertex]
+    base = vertex * problem.num_timeslots
     
     # Vertices with only one timeslot get a big boost to their 
     # badness so they're likely to be chosen at the beginning of the
@@ -1014,9 +1780,9 @@ def bad_value_of_colors(vertex, solution, vertices, edges, overlapping_timeslots
     # the vertex
     for timeslot in timeslots:
 
-        conflict_penalty = conflict_penalty_increase(vertex, timeslot, vertices)
+        conflict_penalty = conflict_penalty_increase(vertex, timeslot, problem)
 
-        proximity_penalty = proximity_penalty_increase(vertex, timeslot, vertices)
+        proximity_penalty = proximity_penalty_increase(vertex, timeslot, problem)
 
         if conflict_penalty > CONFLICT_PENALTY_THRESHOLD:
             bad_value_of_colors += 1
@@ -1028,11 +1794,10 @@ def bad_value_of_colors(vertex, solution, vertices, edges, overlapping_timeslots
         else:
             bad_value_of_colors += float(proximity_penalty) / PROXIMITY_PENALTY_THRESHOLD
             
-        remaining_rooms = get_available_rooms(vertex, timeslot, solution, vertices, overlapping_timeslots)
-        num_remaining_rooms = len(remaining_rooms)
+        num_remaining_rooms = popcount(problem.unassigned_rooms[base + timeslot])
         
         if num_remaining_rooms == 0:
-            if 'LAB' in vertex:
+            if problem.is_lab[vertex]:
                 bad_value_of_colors += 5000
             else:
                 bad_value_of_colors += 10
@@ -1043,21 +1808,26 @@ def bad_value_of_colors(vertex, solution, vertices, edges, overlapping_timeslots
     
 
 #--- Return a list of the n most troublesome vertices from the solution
-def expand(solution, n, vertices, edges, overlapping_timeslots, timeslot_gaps):
-    
-    keys = vertices.keys()
+#
+# bad_values: the bad value of colors of every vertex, as kept by a
+#             SearchTrail, or None to calculate them
+def expand(solution, n, problem, edges, overlapping_timeslots, timeslot_gaps,
+            bad_values = None):
     
     list_of_vertices = []
 
     # Loop over all vertices
-    for vertex in keys:
+    for vertex in xrange(problem.num_sections):
 
         # Skip vertices that have already been colored
         if vertex in solution:
             continue
 
-        value = bad_value_of_colors(vertex, solution, vertices, 
-                                edges, overlapping_timeslots, timeslot_gaps)
+        if bad_values is None:
+            value = bad_value_of_colors(vertex, solution, problem, 
+                                    edges, overlapping_timeslots, timeslot_gaps)
+        else:
+            value = bad_values[vertex]
                                 
         list_of_vertices.append((value, vertex))
         
@@ -1072,37 +1842,29 @@ def expand(solution, n, vertices, edges, overlapping_timeslots, timeslot_gaps):
 # 1. total bad value of colors for all uncolored vertices
 # 2. total conflict penalty
 #
-def priority_function(solution, vertices, edges, overlapping_timeslots, timeslot_gaps):
+def priority_function(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
     
     total_bvoc = 0
     total_edge_weight = 0
     number_of_edges = 0
     bad_value_of_edges = 0
 
-    for vertex in vertices:
+    for vertex in xrange(problem.num_sections):
         if vertex in solution:
             continue
         
-        total_bvoc += bad_value_of_colors(vertex, solution, vertices,
+        total_bvoc += bad_value_of_colors(vertex, solution, problem,
                                             edges, overlapping_timeslots,
                                             timeslot_gaps)
             
-        neighbors = edges[vertex].keys()
+        neighbors = edges.neighbors_of(vertex).tolist()
+        edge_weights = edges.conflict_weights[edges.edges_of(vertex)].tolist()
         
-        for neighbor in neighbors:
+        for neighbor, edge_weight in zip(neighbors, edge_weights):
             
             # Only consider edges between uncolored neighbors
             if neighbor in solution:
                 continue
-            
-            weight = edges[vertex][neighbor]['conflict']
-            
-            if weight == 'H' or weight == 'I':
-                edge_weight = HEAVY_CONFLICT_PENALTY
-            elif weight == 'M':
-                edge_weight = MEDIUM_CONFLICT_PENALTY
-            elif weight == 'L':
-                edge_weight = LIGHT_CONFLICT_PENALTY
                 
             if edge_weight > CONFLICT_PENALTY_THRESHOLD:
                 bad_value_of_edges += 1
@@ -1116,51 +1878,48 @@ def priority_function(solution, vertices, edges, overlapping_timeslots, timeslot
     return total_bvoc, total_edge_weight, number_of_edges, bad_value_of_edges
     
     
-def one_pass_priority(vertices, edges, overlapping_timeslots, timeslot_gaps, solution):
+def one_pass_priority(problem, edges, overlapping_timeslots, timeslot_gaps, solution):
         
-    num_vertices = len(vertices)
-    num_colored_vertices = len(solution)
+    queue = VertexQueue(solution, problem, edges, overlapping_timeslots, timeslot_gaps)
 
-    while num_colored_vertices < num_vertices:
+    while len(queue) > 0:
 
         # Select the "most troublesome" vertex to color
-        # Returns the name of a vertex as entered in the vertices
-        vertex = select_vertex(solution, vertices, edges, overlapping_timeslots, timeslot_gaps)
+        # Returns the id of a vertex in the problem
+        vertex = queue.pop()
 
-        selection = select_color_and_room(vertex, vertices, edges, solution,
+        selection = select_color_and_room(vertex, problem, edges, solution,
                             overlapping_timeslots, timeslot_gaps)
                                                                                     
         color = selection[0][1]
         room = selection[0][2]
                 
         # Make the assignment
-        solution[vertex] = {}
-        solution[vertex]['assigned_timeslot'] = color
-        solution[vertex]['assigned_room'] = room
+        solution[vertex] = (color, room)
                 
-        vertices = update_penalties_and_room_lists(vertex, color, room, vertices, solution,
+        problem = update_penalties_and_room_lists(vertex, color, room, problem, solution,
                                                 edges, overlapping_timeslots, timeslot_gaps)
-                    
-        num_colored_vertices += 1
+
+        queue.assigned(vertex, room)
         
-    total_penalty = calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
+    total_penalty = running_total_penalty(solution, problem, edges, overlapping_timeslots, timeslot_gaps)
 
     return total_penalty
     
     
-def one_pass_lower_bound_current_graph(vertices, edges, overlapping_timeslots, timeslot_gaps, solution):
+def one_pass_lower_bound_current_graph(problem, edges, overlapping_timeslots, timeslot_gaps, solution):
     
     total_penalty = 0
     
-    for vertex in vertices:
+    for vertex in xrange(problem.num_sections):
         if vertex in solution: 
             continue
             
         min_penalty_for_vertex = 10e8
             
-        for t in vertices[vertex]['acceptable_timeslots']:
-            conflict = vertices[vertex][t]['conflict_penalty']
-            proximity = vertices[vertex][t]['proximity_penalty']
+        for t in problem.acceptable_timeslots[vertex]:
+            conflict = conflict_penalty_increase(vertex, t, problem)
+            proximity = proximity_penalty_increase(vertex, t, problem)
             
             total = LINEAR_COMBO_CONFLICT * conflict + LINEAR_COMBO_PROXIMITY * proximity
             
@@ -1171,9 +1930,9 @@ def one_pass_lower_bound_current_graph(vertices, edges, overlapping_timeslots, t
     return total_penalty
     
     
-def one_pass_lower_bound(vertices, edges, overlapping_timeslots, timeslot_gaps, solution):
+def one_pass_lower_bound(problem, edges, overlapping_timeslots, timeslot_gaps, solution):
     
-    num_vertices = len(vertices)
+    num_vertices = problem.num_sections
     starting_solution_size = len(solution)
     num_colored_vertices = len(solution)
 
@@ -1185,18 +1944,18 @@ def one_pass_lower_bound(vertices, edges, overlapping_timeslots, timeslot_gaps,
         most_troublesome_vertex = None
         best_color_for_most_troublesome_vertex = None
         
-        for vertex in vertices:
+        for vertex in xrange(num_vertices):
             if vertex in solution:
                 continue
                 
             bad_value_of_colors = 0.0
             
-            if len(vertices[vertex]['acceptable_timeslots']) == 1:
+            if len(problem.acceptable_timeslots[vertex]) == 1:
                 bad_value_of_colors += 10000
             
-            for t in vertices[vertex]['acceptable_timeslots']:
-                conflict_penalty = vertices[vertex][t]['conflict_penalty']
-                proximity_penalty = vertices[vertex][t]['proximity_penalty']
+            for t in problem.acceptable_timeslots[vertex]:
+                conflict_penalty = conflict_penalty_increase(vertex, t, problem)
+                proximity_penalty = proximity_penalty_increase(vertex, t, problem)
                 
                 if conflict_penalty > CONFLICT_PENALTY_THRESHOLD:
                     bad_value_of_colors += 1
@@ -1219,50 +1978,19 @@ def one_pass_lower_bound(vertices, edges, overlapping_timeslots, timeslot_gaps,
         vertex = most_troublesome_vertex
                 
         min_penalty_for_vertex = 10e8
-        best_color_for_vertex = None
+        best_color_for_vertex = UNASSIGNED
         
-        for t in vertices[vertex]['acceptable_timeslots']:
-            
-            conflict_penalty = vertices[vertex][t]['conflict_penalty']
-            proximity_penalty = vertices[vertex][t]['proximity_penalty']
-                
-            # Calculate the good to bad switch value without considering rooms
-            switched_colors = 0
+        # Calculate the good to bad switch values without considering rooms
+        timeslots = problem.acceptable_timeslots[vertex]
+        switch_values = cached_edge_switch_values(vertex, timeslots, problem, edges,
+                                                    overlapping_timeslots, timeslot_gaps)
 
-            # Consider all the vertices connected by an edge
-            for neighbor in edges[vertex]:
-                
-                for neighbor_timeslot in vertices[neighbor]['acceptable_timeslots']:
-                    
-                    if overlapping_timeslots[neighbor_timeslot][t]:
-                        severity = edges[vertex][neighbor]['conflict']
-                        
-                        neighbor_conflict = vertices[neighbor][neighbor_timeslot]['conflict_penalty']
-                        
-                        if neighbor_conflict > CONFLICT_PENALTY_THRESHOLD:
-                            continue
-                        
-                        if severity == 'H' or severity == 'I':
-                            neighbor_conflict += HEAVY_CONFLICT_PENALTY
-                        elif severity == 'M':
-                            neighbor_conflict += MEDIUM_CONFLICT_PENALTY
-                        elif severity == 'L':
-                            neighbor_conflict += LIGHT_CONFLICT_PENALTY
-                            
-                        if neighbor_conflict > CONFLICT_PENALTY_THRESHOLD:
-                            switched_colors += 1
-                        
-                neighbor_proximity = vertices[neighbor][neighbor_timeslot]['proximity_penalty']
-                
-                if neighbor_proximity > PROXIMITY_PENALTY_THRESHOLD:
-                    continue
-                    
-                gap = timeslot_gaps[neighbor_timeslot][t]
-                overlap_factor = edges[vertex][neighbor]['overlap']
-                neighbor_proximity +=  (float(gap)) * overlap_factor
-                
-                if neighbor_proximity > PROXIMITY_PENALTY_THRESHOLD:
-                    switched_colors += 1
+        for i in range(len(timeslots)):
+            
+            t = timeslots[i]
+            conflict_penalty = conflict_penalty_increase(vertex, t, problem)
+            proximity_penalty = proximity_penalty_increase(vertex, t, problem)
+            switched_colors = switch_values[i]
                 
             total = (LINEAR_COMBO_CONFLICT * conflict_penalty
                      + LINEAR_COMBO_PROXIMITY * proximity_penalty
@@ -1273,133 +2001,344 @@ def one_pass_lower_bound(vertices, edges, overlapping_timeslots, timeslot_gaps,
                 best_color_for_vertex = t
 
         # Select the color assignment that minimizes penalty without regard for rooms
-        solution[most_troublesome_vertex] = {}
-        solution[most_troublesome_vertex]['assigned_timeslot'] = best_color_for_vertex
-        solution[most_troublesome_vertex]['assigned_room'] = vertices[vertex]['acceptable_rooms'][0]
+        solution[most_troublesome_vertex] = (best_color_for_vertex, problem.acceptable_rooms[vertex][0])
         
         #print most_troublesome_vertex, best_color_for_most_troublesome_vertex
 
-        vertices = update_penalties_and_room_lists(most_troublesome_vertex, 
+        problem = update_penalties_and_room_lists(most_troublesome_vertex, 
                                                     best_color_for_vertex, 
-                                                    None, vertices, solution,
+                                                    UNASSIGNED, problem, solution,
                                                     edges, overlapping_timeslots, timeslot_gaps)
                                                     
         num_colored_vertices += 1
         
     for i in range(10):
-        improve(solution, vertices, edges, overlapping_timeslots, timeslot_gaps)
+        improve(solution, problem, edges, overlapping_timeslots, timeslot_gaps)
                                                     
-    penalty = calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
+    penalty = running_total_penalty(solution, problem, edges, overlapping_timeslots, timeslot_gaps)
     #penalty -= (len(solution) - starting_solution_size) * UNASSIGNED_ROOM_PENALTY
  
     return penalty
         
     
+#--- A partial coloring in the priority queue search
+#
+# A node records only the assignment that extends its parent, so the
+# partial colorings in the queue share their common prefixes instead of
+# each holding a copy of the solution and the problem
+class SearchNode(object):
+
+    def __init__(self, parent = None, vertex = None, timeslot = UNASSIGNED, room = UNASSIGNED,
+                    key = 0):
+        self.parent = parent
+        self.vertex = vertex
+        self.timeslot = timeslot
+        self.room = room
+        self.key = key
+
+        if parent is None:
+            self.depth = 0
+        else:
+            self.depth = parent.depth + 1
+
+    def child(self, vertex, timeslot, room, key):
+        return SearchNode(self, vertex, timeslot, room, self.key ^ key)
+
+
+#--- Random 64-bit Zobrist keys for every (section, timeslot) pair
+#
+# The hash of a partial coloring is the xor of the keys of its
+# assignments, so coloring a section updates it in O(1). The last column
+# holds the keys for sections left without a timeslot.
+def zobrist_keys(num_sections, num_timeslots, seed = ZOBRIST_SEED):
+
+    rng = np.random.RandomState(seed)
+    keys = np.frombuffer(rng.bytes(8 * num_sections * (num_timeslots + 1)), dtype = np.uint64)
+
+    return keys.reshape(num_sections, num_timeslots + 1)
+
+
+#--- A bounded set of partial colorings, keyed by (size, hash)
+#
+# When the table is full the least recently seen coloring is dropped
+class TranspositionTable(object):
+
+    def __init__(self, max_size = TRANSPOSITION_TABLE_SIZE):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+
+    # Record a coloring, returning True if it was already in the table
+    def seen(self, node):
+        key = (node.depth, node.key)
+
+        if key in self.entries:
+            self.hits += 1
+            del self.entries[key]
+            self.entries[key] = True
+            return True
+
+        self.entries[key] = True
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+        return False
+
+
+#--- The working state of the priority queue search
+#
+# A single solution and problem are kept in the state of one node. Moving
+# to another node undoes the assignments back to the common ancestor of
+# the two nodes and replays the assignments down to the new one, so a
+# node is only materialised when it is expanded.
+#
+# The trail also keeps the four priority_function features of its
+# solution as running totals, with the bad value of colors of every
+# uncolored vertex. Coloring a vertex only changes the values of its
+# neighbors and of the vertices that can use its room. The totals and
+# values replaced by each assignment are saved and put back when it is
+# undone, so they do not drift.
+class SearchTrail(object):
+
+    def __init__(self, problem, edges, overlapping_timeslots, timeslot_gaps):
+        self.solution = {}
+        self.problem = problem
+        self.edges = edges
+        self.overlapping_timeslots = overlapping_timeslots
+        self.timeslot_gaps = timeslot_gaps
+        self.node = SearchNode()
+        self.zobrist = zobrist_keys(problem.num_sections, problem.num_timeslots)
+
+        self.bad_values = [bad_value_of_colors(v, self.solution, problem, edges,
+                                                overlapping_timeslots, timeslot_gaps)
+                            for v in xrange(problem.num_sections)]
+        self.features = priority_function(self.solution, problem, edges,
+                                            overlapping_timeslots, timeslot_gaps)
+        self.saved_features = []
+
+    def assign(self, vertex, timeslot, room):
+        solution = self.solution
+        problem = self.problem
+        bad_values = self.bad_values
+
+        total_bvoc, total_edge_weight, num_edges, bad_value_of_edges = self.features
+        self.saved_features.append((self.features, vertex, bad_values[vertex], []))
+        changed = self.saved_features[-1][3]
+
+        total_bvoc -= bad_values[vertex]
+
+        # Each edge between uncolored vertices is counted from both ends
+        neighbors = self.edges.neighbors_of(vertex).tolist()
+        edge_weights = self.edges.conflict_weights[self.edges.edges_of(vertex)].tolist()
+
+        for neighbor, edge_weight in zip(neighbors, edge_weights):
+            if neighbor in solution:
+                continue
+
+            if edge_weight > CONFLICT_PENALTY_THRESHOLD:
+                bad_value_of_edges -= 2
+            else:
+                bad_value_of_edges -= 2 * float(edge_weight) / CONFLICT_PENALTY_THRESHOLD
+
+            total_edge_weight -= 2 * edge_weight
+            num_edges -= 2
+
+        solution[vertex] = (timeslot, room)
+        update_penalties_and_room_lists(vertex, timeslot, room, problem, solution,
+                                        self.edges, self.overlapping_timeslots, self.timeslot_gaps)
+
+        affected = set(neighbors)
+        if room != UNASSIGNED:
+            affected.update(problem.room_sections[room])
+
+        for v in affected:
+            if v in solution:
+                continue
+
+            value = bad_value_of_colors(v, solution, problem, self.edges,
+                                        self.overlapping_timeslots, self.timeslot_gaps)
+            if value != bad_values[v]:
+                changed.append((v, bad_values[v]))
+                total_bvoc += value - bad_values[v]
+                bad_values[v] = value
+
+        self.features = (total_bvoc, total_edge_weight, num_edges, bad_value_of_edges)
+
+    def unassign(self, vertex):
+        timeslot, room = self.solution[vertex]
+        update_penalties_and_room_lists(vertex, timeslot, room, self.problem, self.solution,
+                                        self.edges, self.overlapping_timeslots, self.timeslot_gaps,
+                                        deallocate = True)
+        del self.solution[vertex]
+
+        self.features, vertex, value, changed = self.saved_features.pop()
+        self.bad_values[vertex] = value
+        for v, value in changed:
+            self.bad_values[v] = value
+
+    # The node extending the current node by one assignment, without
+    # making the assignment
+    def child(self, vertex, timeslot, room):
+        return self.node.child(vertex, timeslot, room, int(self.zobrist[vertex, timeslot]))
+
+    # Extend the current node by one assignment
+    def push(self, vertex, timeslot, room):
+        self.assign(vertex, timeslot, room)
+        self.node = self.child(vertex, timeslot, room)
+
+    # Undo the last assignment of the current node
+    def pop(self):
+        self.unassign(self.node.vertex)
+        self.node = self.node.parent
+
+    # Move the working state to the given node
+    def goto(self, node):
+        replay = []
+        while node.depth > self.node.depth:
+            replay.append(node)
+            node = node.parent
+
+        while self.node.depth > node.depth:
+            self.pop()
+
+        while self.node is not node:
+            self.pop()
+            replay.append(node)
+            node = node.parent
+
+        for node in reversed(replay):
+            self.push(node.vertex, node.timeslot, node.room)
+
+
+#--- Calculate the priority queue score of extending the current node of
+# a trail by one assignment, leaving the trail unchanged
+def score_child(trail, vertex, timeslot, room):
+
+    solution = trail.solution
+    problem = trail.problem
+
+    trail.push(vertex, timeslot, room)
+
+    # The features of the new solution, as priority_function would
+    # calculate them
+    total_bvoc, total_edge_weight, num_edges, bad_value_of_edges = trail.features
+
+    if CHECK_PENALTY_TOTALS:
+        expected = priority_function(solution, problem, trail.edges, trail.overlapping_timeslots,
+                                        trail.timeslot_gaps)
+        if any(abs(a - b) > 1e-6 * max(1.0, abs(b)) for a, b in zip(trail.features, expected)):
+            print 'Priority features out of sync: ', trail.features, expected
+
+    penalty = running_total_penalty(solution, problem, trail.edges,
+                                    trail.overlapping_timeslots, trail.timeslot_gaps)
+
+    trail.pop()
+
+    return (PRIORITY_TOTAL_PENALTY_WEIGHT * penalty
+            + PRIORITY_TOTAL_BAD_VALUE_WEIGHT * total_bvoc
+            + PRIORITY_TOTAL_EDGE_WEIGHT * total_edge_weight
+            + PRIORITY_NUM_EDGES_WEIGHT * num_edges
+            + PRIORITY_BAD_VALUE_OF_EDGES * bad_value_of_edges)
+
+
 #--- Priority queue solver
-def priority_queue_solver(vertices, edges, overlapping_timeslots, timeslot_gaps):
+#
+# The queue is a heap of (score, order, node) entries holding the best
+# MAX_QUEUE_LENGTH partial colorings; order breaks ties between equal
+# scores in the order the nodes were created
+#
+# monitor: a SolveMonitor, or None. If the deadline comes before any
+#          complete coloring is found, the best partial coloring in the
+#          queue is returned with its other sections left without a
+#          timeslot.
+def priority_queue_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                            monitor = None):
     
-    best_solution = None
-    best_vertices = None
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    trail = SearchTrail(problem, edges, overlapping_timeslots, timeslot_gaps)
+
+    best_node = None
     min_penalty = 10e8
     
-    # The "queue" is really a list that keeps the top MAX_QUEUE_LENGTH
-    # partial colorings
-    queue = []
-    queue.append((0, {}, vertices))
+    queue = [(0, 0, trail.node)]
+    num_nodes = 1
     
-    partial_coloring_cache = {}
+    expanded = TranspositionTable()
+    num_expanded = 0
     
     # Loop until the queue is empty
-    while len(queue) > 0:
-        
-        # Pop the front solution and expand it
-        entry = queue.pop(0)
-        current_solution = entry[1]
-        current_vertices = entry[2]
-            
-        solution_size = len(current_solution)
-        print solution_size
-        
-        solution_list = [(x, current_solution[x]['assigned_timeslot']) for x in current_solution]
-        solution_list = sorted(solution_list)
-        solution_list_string = str(solution_list)
+    while len(queue) > 0 and not monitor.expired():
         
-        if solution_size not in partial_coloring_cache:
-            partial_coloring_cache[solution_size] = {}
+        # Pop the best partial coloring and expand it
+        node = heapq.heappop(queue)[2]
         
-        if solution_list_string in partial_coloring_cache[solution_size]:
+        if expanded.seen(node):
             #print 'Already expanded!'
             continue
-        else:
-            partial_coloring_cache[solution_size][solution_list_string] = True
+
+        trail.goto(node)
+
+        current_solution = trail.solution
+        current_problem = trail.problem
+
+        num_expanded += 1
+        monitor.report('construct', num_expanded, current_problem.penalty_totals.total(),
+                        min_penalty)
 
         list_of_vertices = expand(current_solution, NUM_VERTICES_TO_EXPAND, 
-                                    current_vertices, edges, overlapping_timeslots, 
-                                    timeslot_gaps)
+                                    current_problem, edges, overlapping_timeslots, 
+                                    timeslot_gaps, bad_values = trail.bad_values)
                                             
         # A leaf node has no remaining uncolored vertices
         if len(list_of_vertices) == 0:            
-            penalty = calculate_total_penalty(current_solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
+            penalty = running_total_penalty(current_solution, current_problem, edges,
+                                            overlapping_timeslots, timeslot_gaps)
             
             print 'Found solution: ', penalty
             
             if penalty < min_penalty:
                 min_penalty = penalty
-                best_solution = current_solution
-                best_vertices = current_vertices
+                best_node = trail.node
                 
             continue
                         
         # Assign a color to each vertex 
-        priority_list = []
-        
+        children = []
         for vertex in list_of_vertices:
-            selections = select_color_and_room(vertex, current_vertices, 
+            selections = select_color_and_room(vertex, current_problem, 
                                 edges, current_solution, overlapping_timeslots, timeslot_gaps)
-                                                                        
-            # Construct a new solution
-            for priority, color, room in selections:
-                new_solution = copy.deepcopy(current_solution)
-                new_solution[vertex] = {}
-                new_solution[vertex]['assigned_timeslot'] = color
-                new_solution[vertex]['assigned_room'] = room
-                new_vertices = copy.deepcopy(current_vertices)
-                
-                new_vertices = update_penalties_and_room_lists(vertex, color, room, new_vertices, new_solution,
-                                                        edges, overlapping_timeslots, timeslot_gaps)
-                                    
-                # Calculate the priority of the new solution
-                total_bvoc, total_edge_weight, num_edges, bad_value_of_edges = priority_function(new_solution, 
-                                                            new_vertices, edges, 
-                                                            overlapping_timeslots, 
-                                                            timeslot_gaps)
-                
-                #temp_solution = copy.deepcopy(new_solution)
-                #temp_vertices = copy.deepcopy(new_vertices)
-                #priority = one_pass_priority(temp_vertices, edges, overlapping_timeslots, timeslot_gaps, temp_solution)
-                                
-                penalty = calculate_total_penalty(new_solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
-                
-                #print '\t', vertex, color, room, priority, penalty
 
-                solution_score = (PRIORITY_TOTAL_PENALTY_WEIGHT * penalty
-                                    + PRIORITY_TOTAL_BAD_VALUE_WEIGHT * total_bvoc
-                                    + PRIORITY_TOTAL_EDGE_WEIGHT * total_edge_weight
-                                    + PRIORITY_NUM_EDGES_WEIGHT * num_edges
-                                    + PRIORITY_BAD_VALUE_OF_EDGES * bad_value_of_edges)
-                
-                #solution_score = priority
-                                
-                #print '\t', penalty, total_bvoc, total_edge_weight, num_edges, vertex
-                                
-                queue.append((solution_score, new_solution, new_vertices))
+            children.extend((vertex, color, room) for priority, color, room in selections)
+
+        # Score each new solution
+        for vertex, color, room in children:
+            solution_score = score_child(trail, vertex, color, room)
+            heapq.heappush(queue, (solution_score, num_nodes, trail.child(vertex, color, room)))
+            num_nodes += 1
             
+        # A sorted list is also a heap
         if len(queue) > MAX_QUEUE_LENGTH:
             queue = heapq.nsmallest(MAX_QUEUE_LENGTH, queue)
-        else:
-            queue = sorted(queue)
 
-    return best_solution, best_vertices
+    print 'Transposition table: %d repeated colorings skipped' % expanded.hits
+
+    # Stopped at the deadline without a complete coloring
+    if best_node is None and len(queue) > 0:
+        trail.goto(queue[0][2])
+        for vertex in xrange(problem.num_sections):
+            if vertex not in trail.solution:
+                trail.push(vertex, UNASSIGNED, UNASSIGNED)
+        best_node = trail.node
+        min_penalty = trail.problem.penalty_totals.total()
+
+    if best_node is not None:
+        trail.goto(best_node)
+
+    monitor.report('construct', num_expanded, min_penalty, min_penalty, force = True)
+
+    return trail.solution, trail.problem
     
 
 #--- Read and skip over the parameters block of the input file
@@ -1537,18 +2476,16 @@ def read_instructors(f):
 # This approach better reflects the basic structure of the problem:
 # each section represents a unique vertex in the graph which has
 # edges connecting it to other sections.
-def read_courses(f):
-
-    courses = {}
+#
+# Each section is added directly to the given ProblemInstance, which
+# is also returned
+def read_courses(f, problem):
 
     line = f.readline()
 
     while line.strip() != '':
-        new_course = {}
-
         fields = line.split(' ')
         course_name = fields[0]
-        new_course['name'] = course_name
 
         info = f.readline().strip().split(':')
 
@@ -1559,18 +2496,18 @@ def read_courses(f):
         # Convert timeslots to int
         timeslots = info[2].split(' ')
         timeslots = timeslots[1:len(timeslots) - 1]
-        new_course['acceptable_timeslots'] = [int(x) for x in timeslots]
+        acceptable_timeslots = [int(x) for x in timeslots]
 
         # Code to deal with preferred room could go here
 
         # Room list
         rooms = info[4].split(' ')
-        new_course['acceptable_rooms'] = rooms[1:len(rooms) - 1]
+        acceptable_rooms = rooms[1:len(rooms) - 1]
 
         # Strip the leading space from the instructor name
-        new_course['instructor'] = info[7][1:]
+        instructor = info[7][1:]
 
-        courses[course_name] = new_course
+        problem.add_section(course_name, instructor, acceptable_timeslots, acceptable_rooms)
 
         # Read the first line of the next course entry
         line = f.readline()
@@ -1578,16 +2515,17 @@ def read_courses(f):
     # Read one extra line
     f.readline()
 
-    return courses
+    return problem
 
 
 #--- Read courses from the Fall 2011 input files
 #
 # These files have sections of each course listed under the course name
 # Labs are also listed under the course name
-def read_courses_fall_2011(f):
-    
-    courses = {}
+#
+# Each section is added directly to the given ProblemInstance, which
+# is also returned
+def read_courses_fall_2011(f, problem):
 
     line = f.readline()
 
@@ -1605,61 +2543,50 @@ def read_courses_fall_2011(f):
             lab_offset = 0
 
         for i in range(num_lectures):
-            new_course = {}
             info = f.readline().strip().split(':')
             
             course_name = base_course_name + '_' + str(i + 1)
-            new_course['name'] = course_name
             
             # Convert timeslots to int
             timeslots = info[2 + lab_offset].split(' ')
             timeslots = timeslots[1:len(timeslots) - 1]
-            new_course['acceptable_timeslots'] = [int(x) for x in timeslots]
+            acceptable_timeslots = [int(x) for x in timeslots]
 
             # Code to deal with preferred timeslot could go here
-            preferred_timeslots = info[3 + lab_offset].split()
-            preferred_timeslots = preferred_timeslots[1:len(timeslots) - 1]
-            new_course['preferred_timeslots'] = [int(x) for x in preferred_timeslots]
-
 
             # Room list
             rooms = info[4 + lab_offset].split(' ')
-            new_course['acceptable_rooms'] = rooms[1:len(rooms) - 1]
+            acceptable_rooms = rooms[1:len(rooms) - 1]
 
             # Strip the leading space from the instructor name
-            new_course['instructor'] = info[7 + lab_offset][1:]
+            instructor = info[7 + lab_offset][1:]
 
-            courses[course_name] = new_course
+            problem.add_section(course_name, instructor, acceptable_timeslots, acceptable_rooms)
             
-            print course_name, timeslots, new_course['acceptable_rooms'], new_course['instructor']
+            print course_name, timeslots, acceptable_rooms, instructor
                         
         for i in range(num_labs):  
-            new_course = {}
             info = f.readline().strip().split(':')
             
             course_name = base_course_name + '_' + str(i + 1) + '_' + 'LAB'
-            new_course['name'] = course_name
             
             # Convert timeslots to int
             timeslots = info[2].split(' ')
             timeslots = timeslots[1:len(timeslots) - 1]
-            new_course['acceptable_timeslots'] = [int(x) for x in timeslots]
+            acceptable_timeslots = [int(x) for x in timeslots]
 
             # Code to deal with preferred timeslot could go here
-            preferred_timeslots = info[3].split()
-            preferred_timeslots = preferred_timeslots[1:len(timeslots) - 1]
-            new_course['preferred_timeslots'] = [int(x) for x in preferred_timeslots]
             
             # Room list
             rooms = info[4].split(' ')
-            new_course['acceptable_rooms'] = rooms[1:len(rooms) - 1]
+            acceptable_rooms = rooms[1:len(rooms) - 1]
 
             # Strip the leading space from the instructor name
-            new_course['instructor'] = info[7][1:]
+            instructor = info[7][1:]
 
-            courses[course_name] = new_course  
+            problem.add_section(course_name, instructor, acceptable_timeslots, acceptable_rooms)
             
-            print course_name, timeslots, new_course['acceptable_rooms'], new_course['instructor']
+            print course_name, timeslots, acceptable_rooms, instructor
 
 
         # First line of the next entry
@@ -1669,7 +2596,7 @@ def read_courses_fall_2011(f):
     f.readline()
     f.readline()
 
-    return courses
+    return problem
     
 
 #--- Read the list of course conflict pairs
@@ -1698,73 +2625,203 @@ def read_conflicts(f):
     return conflicts
 
 
-def convert_conflicts(vertices, conflicts):
+#--- Course pairs whose heavy conflicts are always treated as light
+#
+# Each rule is (course, other courses, excluded courses) and applies to
+# section pairs in either order whose names contain the courses. An
+# other courses entry of None matches every section not in the excluded
+# list.
+LIGHT_CONFLICT_OVERRIDES = [
+    ('CHM_220', None, ['BIO_308']),
+    ('BIO_100', ['CHM_120'], []),
+    ('BIO_121', ['CHM_120'], []),
+    ('BIO_201', ['CHM_120'], []),
+    ('CMS_167', ['MAT_111', 'MAT_301'], []),
+    ('PHY_120', ['BIO_121'], []),
+]
+
+
+#--- Index section names by course
+#
+# A course matches every section whose name contains the course name
+# starting at the beginning of an underscore-separated field, so
+# 'CHM_220' finds 'CHM_220_1', the lab 'CHM_220L_1_LAB', and the
+# combined section 'BIO_308_1_CHM_220_1'. Each section is listed under
+# every such substring of its name, in section id order.
+def index_sections_by_course(problem):
+    index = {}
+
+    for name in problem.section_names:
+        starts = [0] + [i + 1 for i in range(len(name)) if name[i] == '_']
+
+        for start in starts:
+            for end in range(start + 1, len(name) + 1):
+                sections = index.setdefault(name[start:end], [])
+                if len(sections) == 0 or sections[-1] != name:
+                    sections.append(name)
+
+    return index
+
+
+#--- Index the light conflict override rules by section
+#
+# The courses of each rule are looked up in sections_by_course, so a
+# rule for 'CHM_220' also covers the lab 'CHM_220L_1_LAB' and combined
+# sections such as 'BIO_308_1_CHM_220_1'
+#
+# Returns: a dictionary mapping each section name matched by the course
+# of a rule to a list of (others, excluded) sets of section names, with
+# others None for a rule matching every other section
+def index_light_overrides(sections_by_course, rules):
+    index = {}
+
+    for course, others, excluded in rules:
+        if others is not None:
+            others = set(name for o in others for name in sections_by_course.get(o, []))
+        excluded = set(name for x in excluded for name in sections_by_course.get(x, []))
+
+        for name in sections_by_course.get(course, []):
+            index.setdefault(name, []).append((others, excluded))
+
+    return index
+
+
+#--- Return True if a light conflict override rule matches a pair of
+# sections, given the index built by index_light_overrides
+def matches_light_override(section_1, section_2, override_index):
+    for name, other in ((section_1, section_2), (section_2, section_1)):
+        for others, excluded in override_index.get(name, []):
+            if (others is None or other in others) and other not in excluded:
+                return True
+
+    return False
+
+
+#--- Expand course-level conflicts to every pair of their sections
+#
+# Heavy conflicts are rescaled by the overlap per section, and made
+# light for the section pairs matched by the override rules
+def convert_conflicts(problem, conflicts, overrides = LIGHT_CONFLICT_OVERRIDES):
     new_conflicts = []
+
+    sections_by_course = index_sections_by_course(problem)
+    override_index = index_light_overrides(sections_by_course, overrides)
     
     for c1, c2, weight, overlap in conflicts:
-        print c1, c2, weight, overlap
-        
-        c1_sections = [x for x in vertices if c1 in vertices[x]['name']]
-        c2_sections = [x for x in vertices if c2 in vertices[x]['name']]
+        c1_sections = sections_by_course.get(c1, [])
+        c2_sections = sections_by_course.get(c2, [])
         
         num_c1_sections = len([x for x in c1_sections if 'LAB' not in x])
         num_c2_sections = len([x for x in c2_sections if 'LAB' not in x])
 
+        # A pair of courses made only of labs is not divided
+        divisor = max(num_c1_sections, num_c2_sections, 1)
+        #if weight == 'H':
+        #    divisor = min(divisor, 6)
+        #elif weight == 'M':
+        #    divisor = min(divisor, 4)
+        #elif weight == 'L':
+        #    divisor = min(divisor, 2)
+        
+        divided_overlap = overlap / divisor
+        
+        output_weight = weight
+        output_overlap = overlap
+        
+        if weight == 'H':
+            if divided_overlap <= 2:
+                output_weight = 'L'
+                output_overlap = 2
+            elif divided_overlap <= 6:
+                output_weight = 'M'
+                output_overlap = 6
+            else:
+                output_weight = 'H'
+                output_overlap = 12
+
         for section_1 in c1_sections:
             for section_2 in c2_sections:
-                divisor = max(num_c1_sections, num_c2_sections)
-                #if weight == 'H':
-                #    divisor = min(divisor, 6)
-                #elif weight == 'M':
-                #    divisor = min(divisor, 4)
-                #elif weight == 'L':
-                #    divisor = min(divisor, 2)
-                
-                divided_overlap = overlap / divisor
-                print num_c1_sections, num_c2_sections, divisor
-                
-                output_weight = weight
-                output_overlap = overlap
-                
-                if weight == 'H':
-                    if (divided_overlap <= 2 or
-                        ('CHM_220' in section_1 and 'BIO_308' not in section_2) or
-                        ('CHM_220' in section_2 and 'BIO_308' not in section_1) or
-                        ('BIO_100' in section_1 and 'CHM_120' in section_2) or
-                        ('BIO_100' in section_2 and 'CHM_120' in section_1) or
-                        ('BIO_121' in section_1 and 'CHM_120' in section_2) or
-                        ('BIO_121' in section_2 and 'CHM_120' in section_1) or
-                        ('BIO_201' in section_1 and 'CHM_120' in section_2) or
-                        ('BIO_201' in section_2 and 'CHM_120' in section_1) or
-                        ('CMS_167' in section_1 and 'MAT_111' in section_2) or
-                        ('CMS_167' in section_2 and 'MAT_111' in section_1) or
-                        ('CMS_167' in section_1 and 'MAT_301' in section_2) or
-                        ('CMS_167' in section_2 and 'MAT_301' in section_1) or
-                        ('PHY_120' in section_1 and 'BIO_121' in section_2) or
-                        ('PHY_120' in section_2 and 'BIO_121' in section_1)):
-                        output_weight = 'L'
-                        output_overlap = 2
-                    elif divided_overlap <= 6:
-                        output_weight = 'M'
-                        output_overlap = 6
-                    else:
-                        output_weight = 'H'
-                        output_overlap = 12
-                    
-                new_conflicts.append((section_1, section_2, output_weight, output_overlap))
-                print '\t', new_conflicts[-1]
+                if (weight == 'H' and output_weight != 'L'
+                        and matches_light_override(section_1, section_2, override_index)):
+                    new_conflicts.append((section_1, section_2, 'L', 2))
+                else:
+                    new_conflicts.append((section_1, section_2, output_weight, output_overlap))
+
     return new_conflicts
 
+#--- Return the conflict penalty paid by an edge of the given severity
+# when the timeslots of its sections overlap
+def conflict_weight(severity):
+    if severity == 'I':
+        return INSTRUCTOR_CONFLICT_PENALTY
+    elif severity == 'H':
+        return HEAVY_CONFLICT_PENALTY
+    elif severity == 'M':
+        return MEDIUM_CONFLICT_PENALTY
+    elif severity == 'L':
+        return LIGHT_CONFLICT_PENALTY
+    else:
+        return 0
+
+
+#--- The conflict graph in compressed sparse row form
+#
+# The neighbors of vertex v are neighbors[offsets[v]:offsets[v + 1]],
+# in increasing order, and edge_ids gives the id of the edge joining v
+# to each of them. Each edge is stored once and seen from both of its
+# ends, with its data in per-edge arrays:
+#
+#   severities: the conflict severity, 'I', 'H', 'M', or 'L'
+#   conflict_weights: the conflict penalty paid when the timeslots of
+#                     the two sections overlap
+#   overlaps: the overlap factor used by the proximity penalty
+#
+# edge_list holds a (vertex, vertex, severity, overlap) tuple for each
+# edge, joining two different vertices
+class EdgeGraph(object):
+
+    def __init__(self, num_vertices, edge_list):
+        self.num_vertices = num_vertices
+        self.num_edges = len(edge_list)
+
+        self.severities = np.array([e[2] for e in edge_list], dtype = 'S1')
+        self.conflict_weights = np.array([conflict_weight(e[2]) for e in edge_list], dtype = int)
+        self.overlaps = np.array([e[3] for e in edge_list], dtype = int)
+
+        # Each edge appears once from each end
+        sources = [e[0] for e in edge_list] + [e[1] for e in edge_list]
+        targets = [e[1] for e in edge_list] + [e[0] for e in edge_list]
+        ids = range(len(edge_list)) * 2
+
+        sources = np.array(sources, dtype = int)
+        targets = np.array(targets, dtype = int)
+        order = np.lexsort((targets, sources))
+
+        self.neighbors = targets[order]
+        self.edge_ids = np.array(ids, dtype = int)[order]
+
+        self.offsets = np.zeros(num_vertices + 1, dtype = int)
+        self.offsets[1:] = np.cumsum(np.bincount(sources, minlength = num_vertices))
+
+    def degree(self, vertex):
+        return self.offsets[vertex + 1] - self.offsets[vertex]
+
+    def neighbors_of(self, vertex):
+        return self.neighbors[self.offsets[vertex]:self.offsets[vertex + 1]]
+
+    def edges_of(self, vertex):
+        return self.edge_ids[self.offsets[vertex]:self.offsets[vertex + 1]]
+
+
 #--- Creates a data structure storing the conflicting edges for each course
 #
 # Conflicts may exist over an instructor or because a specific
 # conflict pair is listed in the input file_name
 #
-# vertices: a dictionary of course entries
-# conflicts: a list of all conflict pairs
+# problem: the ProblemInstance holding the course entries
+# conflicts: a list of all conflict pairs, given by course name
 #
-# Returns: a dictionary with an entry for each course storing that
-# course's conflicts
+# Returns: an EdgeGraph holding each conflicting pair once
 #
 # There are really three kinds of conflicts:
 #   1. an instructor conflict, which is given a prohibitively high penalty
@@ -1772,130 +2829,1226 @@ def convert_conflicts(vertices, conflicts):
 #      between the course pairs
 #   3. the overlap factor, which also reflects the co-enrollment
 #      between the pairs and is used in calculating the proximity penalty
-def build_edges(vertices, conflicts):
-    edges = {}
-
-    for course_name in vertices:
-
-        course_info = vertices[course_name]
+def build_edges(problem, conflicts):
 
-        # Each entry in edges is a dictionary keyed to the names
-        # of courses that have a conflict
-        edges[course_name] = {}
+    # Each pair of section ids (smaller id first) maps to its
+    # [severity, overlap] entry
+    pairs = {}
 
-        # Identify all courses with the same instructor
-        for candidate_name in vertices:
+    # Sections sharing an instructor are grouped by instructor, so only
+    # the pairs inside each group are visited
+    start_time = time.time()
 
-            # A course cannot be in conflict with itself
-            if candidate_name == course_name:
-                continue
+    sections_by_instructor = {}
+    for course in xrange(problem.num_sections):
+        sections_by_instructor.setdefault(problem.instructors[course], []).append(course)
 
-            candidate_info = vertices[candidate_name]
+    for group in sections_by_instructor.values():
+        for i in xrange(len(group)):
+            for j in xrange(i + 1, len(group)):
+                pairs[(group[i], group[j])] = ['I', INSTRUCTOR_OVERLAP_WEIGHT]
 
-            if course_info['instructor'] == candidate_info['instructor']:
-                edges[course_name][candidate_name] = {}
-                edges[course_name][candidate_name]['conflict'] = 'I'
-                edges[course_name][candidate_name]['overlap'] = INSTRUCTOR_OVERLAP_WEIGHT
+    num_instructor_edges = len(pairs)
+    instructor_time = time.time() - start_time
 
-        # Identify all courses in the conflict list that have this
-        # course as one member of a pair
-        for conflict_entry in conflicts:
+    # Conflict pairs are given by name; pairs naming something other
+    # than a section can never match a course and are dropped, as are
+    # pairs of a section with itself, which convert_conflicts produces
+    # for combined sections and which no schedule can avoid
+    #
+    # The first entry for a pair sets its severity. The overlaps of
+    # later entries, including a pair that already has an instructor
+    # conflict, are added to it
+    start_time = time.time()
+
+    section_ids = problem.section_ids
+    for conflict_entry in conflicts:
+        if conflict_entry[0] not in section_ids or conflict_entry[1] not in section_ids:
+            continue
 
-            # The two courses in the conflict entry
-            course_1 = conflict_entry[0]
-            course_2 = conflict_entry[1]
+        course_1 = section_ids[conflict_entry[0]]
+        course_2 = section_ids[conflict_entry[1]]
+        if course_1 == course_2:
+            continue
 
-            # Check both courses in the conflict entry for a match
-            if course_1 == course_name:
+        pair = (min(course_1, course_2), max(course_1, course_2))
 
-                # If the course pair does not have an entry, it was not previously
-                # considered as an instructor conflict
-                if course_2 not in edges[course_name]:
-                    edges[course_name][course_2] = {}
-                    edges[course_name][course_2]['conflict'] = conflict_entry[2]
-                    edges[course_name][course_2]['overlap'] = conflict_entry[3]
+        if pair not in pairs:
+            pairs[pair] = [conflict_entry[2], conflict_entry[3]]
+        else:
+            pairs[pair][1] += conflict_entry[3]
 
-                # If it does have an entry, add the overlap from the conflict entry
-                # to the instructor overlap weight
-                else:
-                    edges[course_name][course_2]['overlap'] += conflict_entry[3]
+    conflict_time = time.time() - start_time
 
-            elif course_2 == course_name:
-                if course_1 not in edges[course_name]:
-                    edges[course_name][course_1] = {}
-                    edges[course_name][course_1]['conflict'] = conflict_entry[2]
-                    edges[course_name][course_1]['overlap'] = conflict_entry[3]
+    print 'Instructor edges: %d in %.3f s' % (num_instructor_edges, instructor_time)
+    print 'Co-enrollment edges: %d in %.3f s' % (len(pairs) - num_instructor_edges, conflict_time)
 
-                else:
-                    edges[course_name][course_1]['overlap'] += conflict_entry[3]
+    edge_list = [(pair[0], pair[1], pairs[pair][0], pairs[pair][1]) for pair in sorted(pairs)]
 
-    return edges
+    return EdgeGraph(problem.num_sections, edge_list)
 
 
 #--- Look for alternate valid timeslots that improve the penalty
-def improve(solution, vertices, edges, overlapping_timeslots, timeslot_gaps):
+def improve(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
             
     # Sort the vertices by penalty
     penalties = []
     
     for vertex in solution:
         
-        assigned_timeslot = solution[vertex]['assigned_timeslot']
-        conflict_penalty = conflict_penalty_increase(vertex, assigned_timeslot, vertices)
-        proximity_penalty = proximity_penalty_increase(vertex, assigned_timeslot, vertices)
+        assigned_timeslot = solution[vertex][0]
+        conflict_penalty = conflict_penalty_increase(vertex, assigned_timeslot, problem)
+        proximity_penalty = proximity_penalty_increase(vertex, assigned_timeslot, problem)
         total_penalty = CONFLICT_PENALTY_WEIGHT * conflict_penalty + PROXIMITY_PENALTY_WEIGHT * proximity_penalty
 
-        penalties.append(total_penalty)
+        penalties.append((total_penalty, vertex))
         
-    course_order = [y for (x, y) in sorted(zip(penalties, vertices.keys()), reverse = True)]
+    course_order = [y for (x, y) in sorted(penalties, reverse = True)]
                 
     # Process from highest penalty vertex to lowest
     for vertex in course_order:
         
-        assigned_timeslot = solution[vertex]['assigned_timeslot']
-        assigned_room = solution[vertex]['assigned_room']
+        assigned_timeslot, assigned_room = solution[vertex]
 
-        conflict_penalty = conflict_penalty_increase(vertex, assigned_timeslot, vertices)
-        proximity_penalty = proximity_penalty_increase(vertex, assigned_timeslot, vertices)
+        conflict_penalty = conflict_penalty_increase(vertex, assigned_timeslot, problem)
+        proximity_penalty = proximity_penalty_increase(vertex, assigned_timeslot, problem)
         
         total_penalty = (CONFLICT_PENALTY_WEIGHT * conflict_penalty 
                          + PROXIMITY_PENALTY_WEIGHT * proximity_penalty)
         
-        for s in vertices[vertex]['acceptable_timeslots']:
+        for s in problem.acceptable_timeslots[vertex]:
                             
-            room_list = get_available_rooms(vertex, s, solution, vertices, overlapping_timeslots)
+            room_list = get_available_rooms(vertex, s, solution, problem, overlapping_timeslots)
 
             if len(room_list) == 0:
                 continue
                 
-            test_conflict_penalty = conflict_penalty_increase(vertex, s, vertices)
-            test_proximity_penalty = proximity_penalty_increase(vertex, s, vertices)
+            test_conflict_penalty = conflict_penalty_increase(vertex, s, problem)
+            test_proximity_penalty = proximity_penalty_increase(vertex, s, problem)
             test_total_penalty = (CONFLICT_PENALTY_WEIGHT * test_conflict_penalty 
                              + PROXIMITY_PENALTY_WEIGHT * test_proximity_penalty)
                                                           
             if test_total_penalty < total_penalty:
                 new_room = room_list[0]
                                            
-                vertices = update_penalties_and_room_lists(vertex, assigned_timeslot, assigned_room, vertices, solution,
+                problem = update_penalties_and_room_lists(vertex, assigned_timeslot, assigned_room, problem, solution,
                                                             edges, overlapping_timeslots, timeslot_gaps,
                                                             deallocate = True)
                                                                                                                         
-                vertices = update_penalties_and_room_lists(vertex, s, new_room, vertices, solution,
+                problem = update_penalties_and_room_lists(vertex, s, new_room, problem, solution,
                                                             edges, overlapping_timeslots, timeslot_gaps)
                 
                 conflict_penalty = test_conflict_penalty
                 proximity_penalty = test_proximity_penalty
                 total_penalty = test_total_penalty
                 
-                solution[vertex]['assigned_timeslot'] = s
-                solution[vertex]['assigned_room'] = new_room
+                solution[vertex] = (s, new_room)
                                 
-                assigned_timeslot = solution[vertex]['assigned_timeslot']
-                assigned_room = solution[vertex]['assigned_room']
+                assigned_timeslot, assigned_room = solution[vertex]
                 
     return solution
+
+
+#--- Move a section to a new timeslot and room
+#
+# The section releases its current assignment before taking the new
+# one, so it may keep its room at an overlapping timeslot
+def reassign_section(vertex, timeslot, room, solution, problem, edges,
+                        overlapping_timeslots, timeslot_gaps):
+
+    old_timeslot, old_room = solution[vertex]
+
+    problem = update_penalties_and_room_lists(vertex, old_timeslot, old_room, problem, solution,
+                                                edges, overlapping_timeslots, timeslot_gaps,
+                                                deallocate = True)
+    problem = update_penalties_and_room_lists(vertex, timeslot, room, problem, solution,
+                                                edges, overlapping_timeslots, timeslot_gaps)
+    solution[vertex] = (timeslot, room)
+
+    return problem
+
+
+#--- Return the problem and solution to a saved solution
+#
+# saved_solution may hold only some of the sections, in which case the
+# others are left as they are. All changed sections are released before
+# any is reassigned, so the rooms of the saved solution are free again
+def restore_solution(solution, saved_solution, problem, edges, overlapping_timeslots,
+                        timeslot_gaps):
+
+    changed = [v for v in saved_solution if solution[v] != saved_solution[v]]
+
+    for v in changed:
+        problem = update_penalties_and_room_lists(v, solution[v][0], solution[v][1], problem, solution,
+                                                    edges, overlapping_timeslots, timeslot_gaps,
+                                                    deallocate = True)
+    for v in changed:
+        timeslot, room = saved_solution[v]
+        problem = update_penalties_and_room_lists(v, timeslot, room, problem, solution,
+                                                    edges, overlapping_timeslots, timeslot_gaps)
+        solution[v] = saved_solution[v]
+
+    return problem
+
+
+#--- Find a room for a vertex at a timeslot with no open room, by moving
+# the single section holding the room to another room at its own
+# timeslot
+#
+# Changing rooms leaves the penalty unchanged, so the repaired move has
+# the same penalty change as the plain move.
+#
+# Returns: (room, holder, holder_room), or None if no room can be freed
+def room_repair(vertex, timeslot, problem, overlapping_timeslots):
+
+    for room in problem.acceptable_rooms[vertex]:
+        if problem.room_occupancy[room, timeslot] != 1:
+            continue
+
+        for holder in problem.room_sections[room]:
+            holder_timeslot = problem.assigned_timeslot[holder]
+
+            if (holder != vertex and problem.assigned_room[holder] == room
+                    and overlapping_timeslots[holder_timeslot, timeslot]):
+
+                mask = problem.unassigned_rooms[holder * problem.num_timeslots + holder_timeslot]
+                free_rooms = RoomList(mask & ~(1 << room), problem.acceptable_rooms[holder])
+
+                if len(free_rooms) > 0:
+                    return room, holder, free_rooms[0]
+                break
+
+    return None
+
+
+#--- Improve a schedule with tabu search
+#
+# Each iteration makes the best admissible move: it reassigns one
+# section to the acceptable timeslot that gives the lowest total
+# penalty, even if that is worse than the current one. The penalty
+# arrays give the change for every (section, timeslot) pair at once.
+# Only a section that pays a penalty can lower the total by moving, so
+# the candidate list holds the pairs of those sections.
+#
+# A timeslot needs an open room. Pairs without one that beat the best
+# open move are tried in order, up to repair_candidates of them, and
+# taken if room_repair can free a room.
+#
+# After a section leaves a timeslot, moving it back is tabu for tenure
+# iterations, unless the move would beat the best penalty found so far.
+# Non-improving moves are ranked with frequency_penalty added for each
+# earlier move of the section, and ties are broken at random, so the
+# search does not keep moving the same few sections across a plateau.
+#
+# The search stops after max_iterations moves, after max_stall moves
+# without a new best, or when no move is admissible. time_limit, in
+# seconds, and the deadline of monitor can stop it earlier; without them
+# the result depends only on rng, a random.Random, or TABU_SEED if rng
+# is None. The problem and solution are left at the best schedule found.
+#
+# Returns: the solution dictionary
+def tabu_search(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                tenure = TABU_TENURE, max_iterations = TABU_MAX_ITERATIONS,
+                time_limit = TABU_TIME_LIMIT, max_stall = TABU_MAX_STALL,
+                frequency_penalty = TABU_FREQUENCY_PENALTY,
+                repair_candidates = TABU_REPAIR_CANDIDATES, monitor = None, rng = None):
+
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    if rng is None:
+        rng = random.Random(TABU_SEED)
+
+    start_time = time.time()
+    time_limit = monitor.time_left(time_limit)
+
+    # Every acceptable (section, timeslot) pair, as parallel arrays
+    pair_sections = []
+    pair_timeslots = []
+    for v in solution:
+        pair_sections.extend([v] * len(problem.acceptable_timeslots[v]))
+        pair_timeslots.extend(problem.acceptable_timeslots[v])
+    pair_sections = np.array(pair_sections, dtype = int)
+    pair_timeslots = np.array(pair_timeslots, dtype = int)
+
+    tabu_until = np.zeros(problem.conflict_penalty.shape, dtype = int)
+    move_count = np.zeros(len(problem.conflict_penalty), dtype = int)
+
+    penalty = problem.penalty_totals.total()
+    best_penalty = penalty
+    best_solution = dict(solution)
+    best_iteration = 0
+    iteration = 0
+
+    while (iteration < max_iterations and iteration - best_iteration < max_stall
+            and (time_limit is None or time.time() - start_time < time_limit)):
+
+        # Current cost of the section of each pair, with UNASSIGNED
+        # paying the room penalty instead of indexing the last timeslot
+        assigned = problem.assigned_timeslot[pair_sections]
+        current = np.where(assigned == UNASSIGNED, UNASSIGNED_ROOM_PENALTY,
+                            CONFLICT_PENALTY_WEIGHT * problem.conflict_penalty[pair_sections, assigned]
+                            + PROXIMITY_PENALTY_WEIGHT * problem.proximity_penalty[pair_sections, assigned])
+
+        deltas = (CONFLICT_PENALTY_WEIGHT * problem.conflict_penalty[pair_sections, pair_timeslots]
+                    + PROXIMITY_PENALTY_WEIGHT * problem.proximity_penalty[pair_sections, pair_timeslots]
+                    - current)
+
+        # Aspiration: a tabu move is allowed if it gives a new best
+        tabu = tabu_until[pair_sections, pair_timeslots] > iteration
+        allowed = ((current > 0) & (pair_timeslots != assigned)
+                    & (~tabu | (penalty + deltas < best_penalty)))
+        has_room = problem.has_open_room[pair_sections, pair_timeslots]
+
+        deltas = np.where(deltas < 0, deltas,
+                            deltas + frequency_penalty * move_count[pair_sections])
+
+        open_moves = np.flatnonzero(allowed & has_room)
+        best_delta = np.inf
+        if len(open_moves) > 0:
+            best_delta = deltas[open_moves].min()
+
+        move = None
+
+        blocked = np.flatnonzero(allowed & ~has_room & (deltas < best_delta))
+        blocked = blocked[np.argsort(deltas[blocked], kind = 'mergesort')]
+        for i in blocked[:repair_candidates]:
+            repair = room_repair(int(pair_sections[i]), int(pair_timeslots[i]), problem,
+                                    overlapping_timeslots)
+            if repair is not None:
+                move = (i, repair)
+                break
+
+        if move is None:
+            if len(open_moves) == 0:
+                break
+
+            ties = open_moves[deltas[open_moves] == best_delta]
+            move = (ties[rng.randrange(len(ties))], None)
+
+        i, repair = move
+        vertex = int(pair_sections[i])
+        timeslot = int(pair_timeslots[i])
+
+        old_timeslot = solution[vertex][0]
+        if old_timeslot != UNASSIGNED:
+            tabu_until[vertex, old_timeslot] = iteration + tenure
+
+        if repair is not None:
+            room, holder, holder_room = repair
+            problem = reassign_section(holder, solution[holder][0], holder_room, solution, problem,
+                                        edges, overlapping_timeslots, timeslot_gaps)
+        else:
+            # Take the open room that leaves the fewest other colors
+            # without a room
+            rooms = list(get_available_rooms(vertex, timeslot, solution, problem, overlapping_timeslots))
+            room_values = cached_room_switch_values(rooms, [timeslot], problem, overlapping_timeslots)[0]
+            room = rooms[np.argmin(room_values)]
+
+        problem = reassign_section(vertex, timeslot, room, solution, problem,
+                                    edges, overlapping_timeslots, timeslot_gaps)
+
+        move_count[vertex] += 1
+        iteration += 1
+        penalty = problem.penalty_totals.total()
+
+        if penalty < best_penalty:
+            best_penalty = penalty
+            best_solution = dict(solution)
+            best_iteration = iteration
+
+        monitor.report('improve', iteration, penalty, best_penalty)
+
+    problem = restore_solution(solution, best_solution, problem, edges, overlapping_timeslots,
+                                timeslot_gaps)
+
+    monitor.report('improve', iteration, best_penalty, best_penalty, force = True)
+
+    print 'Tabu search: %d moves in %.3f s, best found at move %d' % (iteration,
+            time.time() - start_time, best_iteration)
+
+    return solution
+
+
+#--- Weighted penalty paid by a section at a timeslot, given the current
+# assignments of its neighbors
+def section_cost(vertex, timeslot, problem):
+
+    if timeslot == UNASSIGNED:
+        return UNASSIGNED_ROOM_PENALTY
+
+    return (CONFLICT_PENALTY_WEIGHT * problem.conflict_penalty[vertex, timeslot]
+            + PROXIMITY_PENALTY_WEIGHT * problem.proximity_penalty[vertex, timeslot])
+
+
+#--- Return a random room of a bitmask, or UNASSIGNED if it is empty
+#
+# rng: a random.Random, or the random module
+def random_room(mask, acceptable_rooms, rng = random):
+
+    rooms = RoomList(mask, acceptable_rooms)
+    if len(rooms) == 0:
+        return UNASSIGNED
+
+    return rooms[rng.randrange(len(rooms))]
+
+
+#--- Penalty of one edge between sections at two timeslots
+def edge_penalty(edge, timeslot_1, timeslot_2, edges, overlapping_timeslots, timeslot_gaps):
+    return (CONFLICT_PENALTY_WEIGHT * edges.conflict_weights[edge] * overlapping_timeslots[timeslot_1, timeslot_2]
+            + PROXIMITY_PENALTY_WEIGHT * edges.overlaps[edge] * timeslot_gaps[timeslot_1, timeslot_2])
+
+
+#--- Penalty change of moving a group of sections at once
+#
+# targets: a list of (section, new timeslot) pairs
+#
+# The penalty arrays give the change for each section with the others
+# left in place. An edge between two moved sections is counted from both
+# ends at the wrong positions, so it is corrected separately. The cost
+# is O(total degree of the group).
+def group_move_delta(targets, solution, problem, edges, overlapping_timeslots, timeslot_gaps):
+
+    delta = 0.0
+    for vertex, timeslot in targets:
+        delta += section_cost(vertex, timeslot, problem) - section_cost(vertex, solution[vertex][0], problem)
+
+    if len(targets) == 1:
+        return delta
+
+    new_timeslots = dict(targets)
+
+    for vertex, new_1 in targets:
+        old_1 = solution[vertex][0]
+
+        for e, v in zip(edges.edges_of(vertex).tolist(), edges.neighbors_of(vertex).tolist()):
+            if v > vertex and v in new_timeslots:
+                old_2 = solution[v][0]
+                new_2 = new_timeslots[v]
+
+                delta += (edge_penalty(e, new_1, new_2, edges, overlapping_timeslots, timeslot_gaps)
+                            + edge_penalty(e, old_1, old_2, edges, overlapping_timeslots, timeslot_gaps)
+                            - edge_penalty(e, new_1, old_2, edges, overlapping_timeslots, timeslot_gaps)
+                            - edge_penalty(e, old_1, new_2, edges, overlapping_timeslots, timeslot_gaps))
+
+    return delta
+
+
+#--- Local search moves
+#
+# A move is built against the current schedule and changes the
+# timeslots and rooms of a group of sections:
+#
+#   delta(): the change in the total penalty if the move is made, or
+#            np.inf if the move is not possible, without changing state
+#   apply(rng): make the move, returning False and leaving the state
+#               unchanged if some section has no open room at its new
+#               timeslot; rng picks the random rooms
+#   undo(): reverse the last successful apply()
+#
+# Subclasses give the targets, a list of (section, new timeslot) pairs,
+# and the room each section should take. A section takes its own room
+# by default; if the room is not open it takes a random open room,
+# unless the move requires its rooms exactly.
+class Move(object):
+
+    __metaclass__ = abc.ABCMeta
+
+    exact_rooms = False
+
+    def __init__(self, solution, problem, edges, overlapping_timeslots, timeslot_gaps):
+        self.solution = solution
+        self.problem = problem
+        self.edges = edges
+        self.overlapping_timeslots = overlapping_timeslots
+        self.timeslot_gaps = timeslot_gaps
+        self.saved = None
+
+    @abc.abstractmethod
+    def targets(self):
+        pass
+
+    def room_hints(self):
+        return dict((v, self.solution[v][1]) for v, t in self.targets())
+
+    def is_possible(self):
+        targets = self.targets()
+        return (len(targets) > 0 and
+                all(t != UNASSIGNED and self.problem.timeslot_mask[v, t] for v, t in targets))
+
+    def delta(self):
+        if not self.is_possible():
+            return np.inf
+
+        return group_move_delta(self.targets(), self.solution, self.problem, self.edges,
+                                self.overlapping_timeslots, self.timeslot_gaps)
+
+    def apply(self, rng = random):
+        if not self.is_possible():
+            return False
+
+        solution = self.solution
+        problem = self.problem
+        targets = self.targets()
+        hints = self.room_hints()
+
+        saved = dict((v, solution[v]) for v, t in targets)
+
+        for v in saved:
+            update_penalties_and_room_lists(v, saved[v][0], saved[v][1], problem, solution,
+                                            self.edges, self.overlapping_timeslots, self.timeslot_gaps,
+                                            deallocate = True)
+
+        placed = []
+        for v, timeslot in targets:
+            mask = problem.unassigned_rooms[v * problem.num_timeslots + timeslot]
+            room = hints.get(v, UNASSIGNED)
+
+            if room == UNASSIGNED or not (mask >> room) & 1:
+                if self.exact_rooms:
+                    break
+                room = random_room(mask, problem.acceptable_rooms[v], rng)
+                if room == UNASSIGNED:
+                    break
+
+            update_penalties_and_room_lists(v, timeslot, room, problem, solution, self.edges,
+                                            self.overlapping_timeslots, self.timeslot_gaps)
+            placed.append((v, timeslot, room))
+
+        if len(placed) < len(targets):
+            for v, timeslot, room in placed:
+                update_penalties_and_room_lists(v, timeslot, room, problem, solution, self.edges,
+                                                self.overlapping_timeslots, self.timeslot_gaps,
+                                                deallocate = True)
+            for v in saved:
+                update_penalties_and_room_lists(v, saved[v][0], saved[v][1], problem, solution,
+                                                self.edges, self.overlapping_timeslots, self.timeslot_gaps)
+            return False
+
+        for v, timeslot, room in placed:
+            solution[v] = (timeslot, room)
+
+        self.saved = saved
+        return True
+
+    def undo(self):
+        restore_solution(self.solution, self.saved, self.problem, self.edges,
+                            self.overlapping_timeslots, self.timeslot_gaps)
+        self.saved = None
+
+
+#--- Move one section to a timeslot, in the given room if room is not
+# None
+#
+# With the current timeslot and a new room this is a room change, which
+# never changes the penalty
+class TimeslotMove(Move):
+
+    def __init__(self, vertex, timeslot, room, solution, problem, edges,
+                    overlapping_timeslots, timeslot_gaps):
+        Move.__init__(self, solution, problem, edges, overlapping_timeslots, timeslot_gaps)
+        self.vertex = vertex
+        self.timeslot = timeslot
+        self.room = room
+        self.exact_rooms = room is not None
+
+    def targets(self):
+        return [(self.vertex, self.timeslot)]
+
+    def room_hints(self):
+        if self.room is None:
+            return Move.room_hints(self)
+        return {self.vertex: self.room}
+
+
+#--- Exchange the timeslots of two assigned sections
+#
+# Each section takes the room the other leaves if it is acceptable and
+# open, and otherwise a random open room
+class SwapMove(Move):
+
+    def __init__(self, vertex_1, vertex_2, solution, problem, edges,
+                    overlapping_timeslots, timeslot_gaps):
+        Move.__init__(self, solution, problem, edges, overlapping_timeslots, timeslot_gaps)
+        self.vertex_1 = vertex_1
+        self.vertex_2 = vertex_2
+
+    def targets(self):
+        return [(self.vertex_1, self.solution[self.vertex_2][0]),
+                (self.vertex_2, self.solution[self.vertex_1][0])]
+
+    def room_hints(self):
+        return {self.vertex_1: self.solution[self.vertex_2][1],
+                self.vertex_2: self.solution[self.vertex_1][1]}
+
+
+#--- Exchange the rooms of two sections at overlapping timeslots
+#
+# Neither timeslot changes, so the penalty change is always zero. The
+# move is useful because it can open a room for some third section.
+class RoomSwapMove(SwapMove):
+
+    exact_rooms = True
+
+    def targets(self):
+        return [(self.vertex_1, self.solution[self.vertex_1][0]),
+                (self.vertex_2, self.solution[self.vertex_2][0])]
+
+    def is_possible(self):
+        timeslot_1, room_1 = self.solution[self.vertex_1]
+        timeslot_2, room_2 = self.solution[self.vertex_2]
+
+        return (room_1 != UNASSIGNED and room_2 != UNASSIGNED and room_1 != room_2
+                and self.overlapping_timeslots[timeslot_1, timeslot_2]
+                and Move.is_possible(self))
+
+
+#--- Kempe chain interchange between two timeslots
+#
+# The chain is the connected part of the conflict graph, restricted to
+# the sections assigned to either timeslot, that contains vertex. Every
+# section of the chain moves to the other timeslot, so no conflict edge
+# inside the chain gains or loses its shared timeslot. The move is not
+# possible if some section of the chain does not accept its new
+# timeslot or the chain has more than KEMPE_CHAIN_LIMIT sections.
+#
+# Only sections at exactly the two timeslots can swap, so neighbors at
+# other timeslots that overlap one of them are left where they are, and
+# the move can still add conflicts with them. delta() counts those
+# conflicts like any other.
+class KempeChainMove(Move):
+
+    def __init__(self, vertex, timeslot, solution, problem, edges,
+                    overlapping_timeslots, timeslot_gaps):
+        Move.__init__(self, solution, problem, edges, overlapping_timeslots, timeslot_gaps)
+        self.vertex = vertex
+        self.timeslot = timeslot
+        self.chain = self.build_chain()
+
+    def build_chain(self):
+        timeslot_1 = self.solution[self.vertex][0]
+        timeslot_2 = self.timeslot
+        other = {timeslot_1: timeslot_2, timeslot_2: timeslot_1}
+
+        if timeslot_1 == UNASSIGNED or timeslot_1 == timeslot_2:
+            return []
+
+        chain = [(self.vertex, timeslot_2)]
+        in_chain = set([self.vertex])
+        assigned_timeslot = self.problem.assigned_timeslot
+
+        i = 0
+        while i < len(chain):
+            vertex = chain[i][0]
+            i += 1
+
+            for v in self.edges.neighbors_of(vertex).tolist():
+                t = assigned_timeslot[v]
+                if (t == timeslot_1 or t == timeslot_2) and v not in in_chain:
+                    chain.append((v, other[t]))
+                    in_chain.add(v)
+
+            if len(chain) > KEMPE_CHAIN_LIMIT:
+                return []
+
+        return chain
+
+    def targets(self):
+        return self.chain
+
+
+#--- Estimate a starting temperature that accepts a median worsening
+# timeslot move with probability acceptance
+def initial_temperature(solution, problem, acceptance, samples = 200, rng = random):
+
+    sections = [v for v in solution if len(problem.acceptable_timeslots[v]) > 1]
+    increases = []
+
+    for i in range(samples):
+        if len(sections) == 0:
+            break
+
+        vertex = rng.choice(sections)
+        timeslot = rng.choice(problem.acceptable_timeslots[vertex])
+        delta = (section_cost(vertex, timeslot, problem)
+                    - section_cost(vertex, solution[vertex][0], problem))
+        if delta > 0:
+            increases.append(delta)
+
+    if len(increases) == 0:
+        return 1.0
+
+    return -np.median(increases) / np.log(acceptance)
+
+
+#--- Improve a schedule with simulated annealing
+#
+# Each step tries one random move from the move library:
+#
+#   timeslot move: a section takes another acceptable timeslot with an
+#                  open room
+#   section swap: two assigned sections exchange timeslots
+#   room move: a section changes to another open room at its timeslot,
+#              which never changes the penalty but can free a room
+#   Kempe chain: the chain of a section between its timeslot and
+#                another changes sides
+#
+# The penalty change of a move is read from the per-(section, timeslot)
+# penalty arrays in O(degree) of the moved sections, and the move is
+# accepted with the Metropolis rule at the current temperature. Only
+# accepted moves are applied.
+#
+# cooling is 'geometric', which multiplies the temperature by
+# cooling_rate after every steps_per_temperature steps, or 'adaptive',
+# which lowers the temperature when the acceptance ratio of worsening
+# moves is above a target and raises it when it is below. The target
+# falls linearly from initial_acceptance to 0 over the time limit or
+# max_steps, whichever is further along, so adaptive cooling needs at
+# least one of them.
+#
+# After reheat_after temperature changes without a new best schedule,
+# the temperature is reset to reheat_fraction of the starting one.
+#
+# The search stops after time_limit seconds, max_steps steps or the
+# deadline of monitor, where None means no limit, and the problem and
+# solution are left at the best schedule found. Without a time limit or
+# deadline the result depends only on rng, a random.Random, or SA_SEED
+# if rng is None.
+#
+# Returns: the solution dictionary
+def simulated_annealing(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                        time_limit = SA_TIME_LIMIT, max_steps = SA_MAX_STEPS,
+                        cooling = 'geometric',
+                        temperature = None, cooling_rate = SA_COOLING_RATE,
+                        steps_per_temperature = SA_STEPS_PER_TEMPERATURE,
+                        initial_acceptance = SA_INITIAL_ACCEPTANCE,
+                        reheat_after = SA_REHEAT_AFTER, reheat_fraction = SA_REHEAT_FRACTION,
+                        monitor = None, rng = None):
+
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    if rng is None:
+        rng = random.Random(SA_SEED)
+
+    start_time = time.time()
+    time_limit = monitor.time_left(time_limit)
+    num_timeslots = problem.num_timeslots
+
+    if cooling == 'adaptive' and time_limit is None and max_steps is None:
+        raise ValueError('Adaptive cooling needs a time limit or a step limit')
+
+    movable = [v for v in solution if len(problem.acceptable_timeslots[v]) > 0]
+
+    if temperature is None:
+        temperature = initial_temperature(solution, problem, initial_acceptance, rng = rng)
+    start_temperature = temperature
+
+    penalty = problem.penalty_totals.total()
+    best_penalty = penalty
+    best_solution = dict(solution)
+
+    step = 0
+    num_accepted = 0
+    num_reheats = 0
+    stale_temperatures = 0
+    worsening_tried = 0
+    worsening_accepted = 0
+
+    while len(movable) > 0 and (max_steps is None or step < max_steps):
+
+        if step % steps_per_temperature == 0 and step > 0:
+            elapsed = time.time() - start_time
+            if time_limit is not None and elapsed >= time_limit:
+                break
+
+            monitor.report('improve', step, penalty, best_penalty)
+
+            if cooling == 'adaptive':
+                progress = 0.0
+                if time_limit is not None:
+                    progress = elapsed / time_limit
+                if max_steps is not None:
+                    progress = max(progress, float(step) / max_steps)
+
+                target = initial_acceptance * (1.0 - progress)
+                if worsening_tried > 0 and worsening_accepted > target * worsening_tried:
+                    temperature *= cooling_rate
+                else:
+                    temperature /= cooling_rate
+            else:
+                temperature *= cooling_rate
+
+            worsening_tried = 0
+            worsening_accepted = 0
+
+            stale_temperatures += 1
+            if stale_temperatures >= reheat_after:
+                temperature = max(temperature, reheat_fraction * start_temperature)
+                stale_temperatures = 0
+                num_reheats += 1
+
+        step += 1
+
+        vertex = movable[rng.randrange(len(movable))]
+        timeslot, room = solution[vertex]
+        new_timeslot = rng.choice(problem.acceptable_timeslots[vertex])
+        kind = rng.random()
+        move = None
+
+        if kind < SA_ROOM_MOVE_PROBABILITY:
+            if timeslot != UNASSIGNED:
+                mask = problem.unassigned_rooms[vertex * num_timeslots + timeslot]
+                new_room = random_room(mask & ~(1 << room), problem.acceptable_rooms[vertex], rng)
+                if new_room != UNASSIGNED:
+                    move = TimeslotMove(vertex, timeslot, new_room, solution, problem, edges,
+                                        overlapping_timeslots, timeslot_gaps)
+
+        elif kind < SA_ROOM_MOVE_PROBABILITY + SA_SWAP_PROBABILITY:
+
+            # A partner at one of the acceptable timeslots of vertex
+            # that can take the timeslot of vertex in return
+            if timeslot != UNASSIGNED and new_timeslot != timeslot:
+                partners = np.flatnonzero((problem.assigned_timeslot[:problem.num_sections] == new_timeslot)
+                                            & problem.timeslot_mask[:problem.num_sections, timeslot])
+                if len(partners) > 0:
+                    move = SwapMove(vertex, int(partners[rng.randrange(len(partners))]), solution,
+                                    problem, edges, overlapping_timeslots, timeslot_gaps)
+
+        elif kind < SA_ROOM_MOVE_PROBABILITY + SA_SWAP_PROBABILITY + SA_KEMPE_PROBABILITY:
+            move = KempeChainMove(vertex, new_timeslot, solution, problem, edges,
+                                    overlapping_timeslots, timeslot_gaps)
+
+        elif new_timeslot != timeslot and problem.has_open_room[vertex, new_timeslot]:
+            move = TimeslotMove(vertex, new_timeslot, None, solution, problem, edges,
+                                overlapping_timeslots, timeslot_gaps)
+
+        if move is None:
+            continue
+
+        delta = move.delta()
+        if delta == np.inf:
+            continue
+
+        # Metropolis acceptance
+        if delta > 0:
+            worsening_tried += 1
+            if temperature <= 0 or rng.random() >= np.exp(-delta / temperature):
+                continue
+            worsening_accepted += 1
+
+        if not move.apply(rng):
+            continue
+
+        num_accepted += 1
+        penalty = problem.penalty_totals.total()
+
+        if penalty < best_penalty:
+            best_penalty = penalty
+            best_solution = dict(solution)
+            stale_temperatures = 0
+
+    problem = restore_solution(solution, best_solution, problem, edges, overlapping_timeslots,
+                                timeslot_gaps)
+
+    monitor.report('improve', step, best_penalty, best_penalty, force = True)
+
+    print 'Simulated annealing: %d steps, %d accepted, %d reheats in %.3f s' % (step,
+            num_accepted, num_reheats, time.time() - start_time)
+
+    return solution
     
     
+#--- Choose the sections to unassign in one large neighbourhood search
+# iteration, around a seed section
+#
+# kind is one of
+#
+#   'instructor': the sections of the instructor of the seed
+#   'conflicts': the seed and its neighbors in the conflict graph,
+#                breadth first
+#   'room': the sections in the room of the seed that meet within
+#           band_width minutes of it, given the week_masks of the
+#           timeslots
+#
+# The neighbourhood holds at most size sections, always including the
+# seed, with the others drawn in an order shuffled by rng.
+def lns_neighborhood(kind, seed, solution, problem, edges, week_masks, instructor_sections,
+                        size, band_width = LNS_BAND_WIDTH, rng = random):
+
+    if kind == 'instructor':
+        sections = list(instructor_sections.get(problem.instructors[seed], [seed]))
+
+    elif kind == 'room':
+        timeslot, room = solution[seed]
+        sections = [seed]
+
+        if room != UNASSIGNED:
+            blocks = band_width / TIME_RESOLUTION
+            band = week_masks[timeslot]
+            for shift in range(1, blocks + 1):
+                band |= (week_masks[timeslot] << shift) | (week_masks[timeslot] >> shift)
+
+            sections = [v for v in problem.room_sections[room]
+                        if problem.assigned_room[v] == room
+                        and week_masks[problem.assigned_timeslot[v]] & band]
+
+    else:
+        sections = [seed]
+        in_sections = set(sections)
+
+        i = 0
+        while i < len(sections) and len(sections) < size:
+            for v in edges.neighbors_of(sections[i]).tolist():
+                if v not in in_sections:
+                    sections.append(v)
+                    in_sections.add(v)
+            i += 1
+
+    sections = [v for v in sections if v != seed]
+    rng.shuffle(sections)
+
+    return [seed] + sections[:size - 1]
+
+
+#--- Large neighbourhood search
+#
+# Each iteration picks a seed among the sections that pay a penalty and
+# a kind of neighbourhood around it, unassigns the neighbourhood through
+# the deallocate path of update_penalties_and_room_lists, and reinserts
+# it with one_pass_solver. The new schedule is kept if its penalty is no
+# worse than before and otherwise undone, so only a few dozen sections
+# change on each iteration, and only they are rescored by the rebuild.
+#
+# noise, top_k: the randomness of the rebuild, as in one_pass_solver
+# rng: a random.Random for every random choice of the search, or None
+#      for one seeded with LNS_SEED
+#
+# The search stops after time_limit seconds, max_iterations iterations
+# or the deadline of monitor, where None means no limit, and the problem
+# and solution are left at the best schedule found.
+#
+# Returns: the solution dictionary
+def large_neighborhood_search(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                                time_limit = LNS_TIME_LIMIT, max_iterations = None,
+                                size = LNS_NEIGHBORHOOD_SIZE, noise = LNS_NOISE,
+                                top_k = LNS_TOP_K, monitor = None, rng = None):
+
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    if rng is None:
+        rng = random.Random(LNS_SEED)
+
+    start_time = time.time()
+    time_limit = monitor.time_left(time_limit)
+
+    week_masks = [ParsedTimeslot(t).week_mask for t in problem.timeslot_strings]
+    week_masks.append(0)
+
+    instructor_sections = {}
+    for v in solution:
+        if problem.instructors[v]:
+            instructor_sections.setdefault(problem.instructors[v], []).append(v)
+
+    kinds = ['instructor', 'conflicts', 'room']
+    sections_range = np.arange(problem.num_sections)
+
+    penalty = problem.penalty_totals.total()
+    iteration = 0
+    num_accepted = 0
+
+    while ((max_iterations is None or iteration < max_iterations)
+            and (time_limit is None or time.time() - start_time < time_limit)):
+
+        iteration += 1
+
+        # Sections paying a penalty, with UNASSIGNED paying the room
+        # penalty instead of indexing the last timeslot
+        assigned = problem.assigned_timeslot[:problem.num_sections]
+        costs = np.where(assigned == UNASSIGNED, UNASSIGNED_ROOM_PENALTY,
+                            problem.conflict_penalty[sections_range, assigned]
+                            + problem.proximity_penalty[sections_range, assigned])
+        candidates = np.flatnonzero(costs > 0)
+        if len(candidates) == 0:
+            break
+
+        seed = int(candidates[rng.randrange(len(candidates))])
+        kind = kinds[rng.randrange(len(kinds))]
+        sections = lns_neighborhood(kind, seed, solution, problem, edges, week_masks,
+                                    instructor_sections, size, rng = rng)
+
+        # Destroy
+        saved = dict((v, solution[v]) for v in sections)
+        for v in sections:
+            problem = update_penalties_and_room_lists(v, solution[v][0], solution[v][1], problem,
+                                                        solution, edges, overlapping_timeslots,
+                                                        timeslot_gaps, deallocate = True)
+            del solution[v]
+
+        # Repair
+        solution = one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                                    rng = rng, noise = noise, top_k = top_k,
+                                    solution = solution, vertices = sections)
+
+        new_penalty = problem.penalty_totals.total()
+        if new_penalty <= penalty:
+            penalty = new_penalty
+            num_accepted += 1
+        else:
+            problem = restore_solution(solution, saved, problem, edges, overlapping_timeslots,
+                                        timeslot_gaps)
+
+        monitor.report('improve', iteration, penalty, penalty)
+
+    monitor.report('improve', iteration, penalty, penalty, force = True)
+
+    print 'Large neighbourhood search: %d iterations, %d accepted in %.3f s' % (iteration,
+            num_accepted, time.time() - start_time)
+
+    return solution
+
+
+#--- Improve a constructed schedule with the configured engine
+#
+# rng: a random.Random for the random choices of the engine, or None
+#      for its default
+def improve_schedule(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                        monitor = None, rng = None):
+
+    if USE_ANNEALING:
+        return simulated_annealing(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                                    monitor = monitor, rng = rng)
+
+    return tabu_search(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                        monitor = monitor, rng = rng)
+
+
+#--- Assign every section of a solution in a problem without assignments
+def assign_solution(solution, problem, edges, overlapping_timeslots, timeslot_gaps):
+
+    for vertex in sorted(solution):
+        timeslot, room = solution[vertex]
+        problem = update_penalties_and_room_lists(vertex, timeslot, room, problem, solution,
+                                                    edges, overlapping_timeslots, timeslot_gaps)
+
+    return problem
+
+
+# The problem, edges, matrices, deadline, and improve flag shared by the
+# starts run in a worker process, set by init_multi_start_worker. quiet is set in pool
+# workers, whose output would interleave.
+multi_start_state = None
+
+
+def init_multi_start_worker(problem, edges, overlapping_timeslots, timeslot_gaps,
+                            deadline = None, improve = True, quiet = False):
+    global multi_start_state
+    multi_start_state = (problem, edges, overlapping_timeslots, timeslot_gaps, deadline,
+                            improve, quiet)
+
+
+#--- Run one randomized start: a one-pass construction on a copy of the
+# shared problem, followed by improvement
+#
+# The seed drives a random.Random used by both the construction, which
+# can be repeated from it, and the improvement engine, whose result
+# also depends on how far it gets before a deadline.
+#
+# Returns: (seed, penalty, penalty before improvement, solution)
+def run_multi_start(seed):
+
+    quiet = multi_start_state[6]
+    if not quiet:
+        return multi_start(seed)
+
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            return multi_start(seed)
+        finally:
+            sys.stdout = stdout
+
+
+#--- Run one start, or return None if the deadline has passed before it
+# begins
+def multi_start(seed):
+
+    problem, edges, overlapping_timeslots, timeslot_gaps, deadline, improve, quiet = multi_start_state
+    monitor = SolveMonitor(deadline)
+    if monitor.expired():
+        return None
+
+    problem = problem.copy()
+    rng = random.Random(seed)
+
+    solution = one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                                rng = rng, monitor = monitor)
+    constructed_penalty = problem.penalty_totals.total()
+    if improve:
+        solution = improve_schedule(solution, problem, edges, overlapping_timeslots, timeslot_gaps,
+                                    monitor = monitor, rng = rng)
+
+    return seed, problem.penalty_totals.total(), constructed_penalty, solution
+
+
+#--- Run randomized one-pass starts in parallel and keep the best
+#
+# problem: a ProblemInstance with no assignments, which is left
+#          unchanged
+# seeds: one seed per start
+# processes: the number of worker processes, or None for one per CPU
+# monitor: a SolveMonitor, or None. Every start stops reserve seconds
+#          before its deadline, and starts that would begin after that
+#          are skipped; if none runs, the sections are left without
+#          timeslots. An event is reported as each start finishes.
+# improve: False to skip the improvement of each start
+#
+# Returns: the best solution, a copy of problem holding it, and a list
+# of (seed, penalty, penalty before improvement) for each start that
+# ran, in seed order
+def multi_start_solver(problem, edges, overlapping_timeslots, timeslot_gaps, seeds,
+                        processes = MULTI_START_PROCESSES, monitor = None, improve = True,
+                        reserve = MULTI_START_DEADLINE_RESERVE):
+
+    if monitor is None:
+        monitor = SolveMonitor()
+
+    deadline = monitor.deadline
+    if deadline is not None:
+        deadline -= reserve
+
+    seeds = list(seeds)
+    args = (problem, edges, overlapping_timeslots, timeslot_gaps, deadline, improve)
+
+    pool = None
+    if processes == 1 or len(seeds) == 1:
+        init_multi_start_worker(*args)
+        finished = (run_multi_start(seed) for seed in seeds)
+    else:
+        pool = multiprocessing.Pool(processes, init_multi_start_worker, args + (True,))
+        finished = pool.imap(run_multi_start, seeds, chunksize = 1)
+
+    starts = []
+    try:
+        for start in finished:
+            if start is None:
+                continue
+            starts.append(start)
+            monitor.report('start', start[0], start[1], min(s[1] for s in starts), force = True)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Every start would have begun after the deadline: the first one
+    # leaves all of its sections without a timeslot
+    if len(starts) == 0:
+        solution = {}
+        empty_problem = leave_unassigned(solution, problem.copy(), edges, overlapping_timeslots,
+                                            timeslot_gaps)
+        penalty = empty_problem.penalty_totals.total()
+        starts.append((seeds[0], penalty, penalty, solution))
+
+    best = min(starts, key = lambda start: start[1])
+    best_solution = best[3]
+    best_problem = assign_solution(best_solution, problem.copy(), edges,
+                                    overlapping_timeslots, timeslot_gaps)
+
+    results = [(seed, penalty, constructed_penalty)
+                for (seed, penalty, constructed_penalty, solution) in starts]
+
+    return best_solution, best_problem, results
+
+
+#--- Solve strategies
+#
+# Each strategy builds a complete schedule for a problem with no
+# assignments and, if improve is True, improves it, within the deadline
+# of a SolveMonitor.
+#
+# Returns: (solution, problem), where problem holds the solution
+def solve_one_pass(problem, edges, overlapping_timeslots, timeslot_gaps, monitor, improve):
+
+    solution = one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                                monitor = monitor)
+    if improve:
+        solution = improve_schedule(solution, problem, edges, overlapping_timeslots,
+                                    timeslot_gaps, monitor = monitor)
+
+    return solution, problem
+
+
+def solve_priority_queue(problem, edges, overlapping_timeslots, timeslot_gaps, monitor,
+                            improve):
+
+    solution, problem = priority_queue_solver(problem, edges, overlapping_timeslots,
+                                                timeslot_gaps, monitor = monitor)
+    if improve:
+        solution = improve_schedule(solution, problem, edges, overlapping_timeslots,
+                                    timeslot_gaps, monitor = monitor)
+
+    return solution, problem
+
+
+def solve_multi_start(problem, edges, overlapping_timeslots, timeslot_gaps, monitor, improve):
+
+    solution, problem, results = multi_start_solver(problem, edges, overlapping_timeslots,
+                                                    timeslot_gaps, range(NUM_STARTS),
+                                                    monitor = monitor, improve = improve)
+
+    return solution, problem
+
+
+def solve_lns(problem, edges, overlapping_timeslots, timeslot_gaps, monitor, improve):
+
+    solution = one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps,
+                                monitor = monitor)
+    if improve:
+        solution = large_neighborhood_search(solution, problem, edges, overlapping_timeslots,
+                                                timeslot_gaps, monitor = monitor)
+
+    return solution, problem
+
+
+SOLVE_STRATEGIES = {
+    'one_pass': solve_one_pass,
+    'priority_queue': solve_priority_queue,
+    'multi_start': solve_multi_start,
+    'lns': solve_lns,
+}
+
+
+#--- Solve a problem with a strategy from SOLVE_STRATEGIES
+#
+# deadline: a time.time() value by which the solve returns, or None. The
+#           solvers check it as they go, and keep a complete schedule
+#           to return whenever it passes.
+# on_progress: a function called with progress events, as described for
+#              SolveMonitor
+# improve: False to return the constructed schedule without running the
+#          improvement phase of the strategy
+#
+# Returns: (solution, problem), where problem holds the solution
+def solve(problem, edges, overlapping_timeslots, timeslot_gaps, strategy = 'one_pass',
+            deadline = None, on_progress = None, improve = True):
+
+    if strategy not in SOLVE_STRATEGIES:
+        raise ValueError('Unknown solve strategy: ' + str(strategy))
+
+    monitor = SolveMonitor(deadline, on_progress)
+
+    return SOLVE_STRATEGIES[strategy](problem, edges, overlapping_timeslots, timeslot_gaps,
+                                        monitor, improve)
+
+
+#--- Print a progress event from solve
+def print_progress(event):
+    print '%s %d: penalty %s, best %s after %.3f s' % (event['phase'], event['iteration'],
+            event['penalty'], event['best_penalty'], event['elapsed'])
+
+
 #--- Read a .ctb input file and build the couse_info dictionary
 #
 # The .ctb file format is backwards-compatible with the earlier
@@ -1912,46 +4065,43 @@ def schedule_ctb_file(input_file_name):
     course_prefix_list = read_course_prefixes(f)
     instructor_list = read_instructors(f)
     
+    # Each section in the problem has a list of the remaining unassigned
+    # rooms at each of its suitable timeslots and a record of the conflict
+    # and proximity penalties that would be incurred by the assignment
+    # of each suitable timeslot
+    problem = ProblemInstance(timeslot_list, room_list)
+    
     if 'f11' in input_file_name:
-        vertices = read_courses_fall_2011(f)
+        problem = read_courses_fall_2011(f, problem)
     else:
-        vertices = read_courses(f)
+        problem = read_courses(f, problem)
     
     conflicts = read_conflicts(f)
     
     if 'f11' in input_file_name:
-        conflicts = convert_conflicts(vertices, conflicts)
-    
-    # Each vertex has a list of the remaining unassigned rooms at each
-    # of its suitable timeslots and a record of the conflict and
-    # proximity penalties that would be incurred by the assignment
-    # of each suitable timeslot
-    for course in vertices:
-        for timeslot in vertices[course]['acceptable_timeslots']:
-            vertices[course][timeslot] = {}
-            vertices[course][timeslot]['unassigned_rooms'] = copy.copy(vertices[course]['acceptable_rooms'])
-            
-            vertices[course][timeslot]['conflict_penalty'] = 0.0
-            vertices[course][timeslot]['proximity_penalty'] = 0.0
+        conflicts = convert_conflicts(problem, conflicts)
 
     # Build the structure of conflicting edges
-    edges = build_edges(vertices, conflicts)
+    edges = build_edges(problem, conflicts)
     
-    # Build a dict reporting whether pairs of timeslots overlap and
-    # a dict reporting the gaps between pairs of timeslots
-    overlapping_timeslots, timeslot_gaps = calculate_overlapping_timeslots_and_gaps(timeslot_list)
+    # Build a matrix reporting whether pairs of timeslots overlap and
+    # a matrix reporting the gaps between pairs of timeslots
+    overlapping_timeslots, timeslot_gaps = cached_overlapping_timeslots_and_gaps(timeslot_list)
         
     # Solve
-    if USE_ONE_PASS:
-        solution = one_pass_solver(vertices, edges, overlapping_timeslots, timeslot_gaps)
+    if not USE_ONE_PASS:
+        strategy = 'priority_queue'
+    elif NUM_STARTS > 1:
+        strategy = 'multi_start'
     else:
-        solution, vertices = priority_queue_solver(vertices, edges, overlapping_timeslots, timeslot_gaps)
-        
-    penalty = calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
-    print 'Total penalty before improvement: ', penalty
+        strategy = 'one_pass'
+
+    deadline = None
+    if SOLVE_TIME_LIMIT is not None:
+        deadline = time.time() + SOLVE_TIME_LIMIT
 
-    for improve_count in range(10):
-        solution = improve(solution, vertices, edges, overlapping_timeslots, timeslot_gaps)
+    solution, problem = solve(problem, edges, overlapping_timeslots, timeslot_gaps, strategy,
+                                deadline = deadline, on_progress = print_progress)
 
     # Output the solution
     courses_without_rooms = 0
@@ -1959,22 +4109,23 @@ def schedule_ctb_file(input_file_name):
     solution_keys = solution.keys()
     solution_keys.sort()
     for course in solution_keys:
-        slot = solution[course]['assigned_timeslot']
-        room = solution[course]['assigned_room']
-        #print course, slot, room
+        slot, room = solution[course]
+        #print problem.section_names[course], slot, room
         
-        if room == None:
+        if room == UNASSIGNED:
             courses_without_rooms += 1
                             
-    # Calculate and report the penalty
-    global PRINT_CONFLICTS
-    PRINT_CONFLICTS = True
-    penalty = calculate_total_penalty(solution, edges, overlapping_timeslots, timeslot_gaps, vertices)
-    PRINT_CONFLICTS = False
+    # Report the penalty
+    problem.penalty_totals.report()
+    penalty = running_total_penalty(solution, problem, edges, overlapping_timeslots, timeslot_gaps)
     
     print 'Total penalty including unscheduled courses: ', penalty
     
     print 'Number of unscheduled courses = ', courses_without_rooms
+
+    stats = problem.switch_memo_stats
+    print 'Switch value memo hits/misses: edges %d/%d, rooms %d/%d' % (stats['edge_hits'],
+            stats['edge_misses'], stats['room_hits'], stats['room_misses'])
     
     return penalty
 
@@ -0,0 +1,353 @@
+# Checks of the solver against reference calculations
+#
+# Run with: python -m unittest test_solver
+
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import solver
+
+TIMESLOTS = ['0 MWF 8:00 am - 8:50 am', '1 MWF 9:00 am - 9:50 am', '2 TR 8:00 am - 9:15 am']
+ROOMS = ['BUSH_101', 'BUSH_102']
+
+
+#--- Build a problem holding the named sections, each acceptable at
+# every timeslot and room
+def make_problem(section_names, instructors = None):
+    problem = solver.ProblemInstance(TIMESLOTS, ROOMS)
+
+    for i in range(len(section_names)):
+        instructor = 'Staff_' + str(i)
+        if instructors is not None:
+            instructor = instructors[i]
+        problem.add_section(section_names[i], instructor, [0, 1, 2], ROOMS)
+
+    return problem
+
+
+#--- The heavy conflict override test of the original convert_conflicts,
+# which compared substrings of the two section names
+def baseline_light_override(section_1, section_2):
+    return (('CHM_220' in section_1 and 'BIO_308' not in section_2) or
+            ('CHM_220' in section_2 and 'BIO_308' not in section_1) or
+            ('BIO_100' in section_1 and 'CHM_120' in section_2) or
+            ('BIO_100' in section_2 and 'CHM_120' in section_1) or
+            ('BIO_121' in section_1 and 'CHM_120' in section_2) or
+            ('BIO_121' in section_2 and 'CHM_120' in section_1) or
+            ('BIO_201' in section_1 and 'CHM_120' in section_2) or
+            ('BIO_201' in section_2 and 'CHM_120' in section_1) or
+            ('CMS_167' in section_1 and 'MAT_111' in section_2) or
+            ('CMS_167' in section_2 and 'MAT_111' in section_1) or
+            ('CMS_167' in section_1 and 'MAT_301' in section_2) or
+            ('CMS_167' in section_2 and 'MAT_301' in section_1) or
+            ('PHY_120' in section_1 and 'BIO_121' in section_2) or
+            ('PHY_120' in section_2 and 'BIO_121' in section_1))
+
+
+SEARCH_TIMESLOTS = ['0 MWF 8:00 am - 8:50 am', '1 MWF 9:00 am - 9:50 am',
+                    '2 MWF 10:00 am - 10:50 am', '3 MWF 1:00 pm - 1:50 pm',
+                    '4 TR 8:00 am - 9:15 am', '5 TR 9:30 am - 10:45 am',
+                    '6 TR 2:00 pm - 3:15 pm', '7 MW 8:30 am - 9:45 am']
+SEARCH_ROOMS = ['BUSH_101', 'BUSH_102', 'BUSH_103']
+
+
+#--- Build a random problem with more sections than open rooms, so the
+# searches have conflicts to remove and sections left unassigned
+#
+# Returns: the problem, its edges, and the overlap and gap matrices
+def make_search_problem(num_sections = 24, num_conflicts = 40, seed = 0):
+    rng = random.Random(seed)
+    problem = solver.ProblemInstance(SEARCH_TIMESLOTS, SEARCH_ROOMS)
+
+    for i in range(num_sections):
+        timeslots = sorted(rng.sample(range(len(SEARCH_TIMESLOTS)), rng.randint(2, 5)))
+        rooms = sorted(rng.sample(SEARCH_ROOMS, rng.randint(1, 2)))
+        problem.add_section('CRS_%d_1' % i, 'Staff_%d' % (i % 8), timeslots, rooms)
+
+    conflicts = []
+    for i in range(num_conflicts):
+        section_1, section_2 = rng.sample(problem.section_names, 2)
+        severity, overlap = rng.choice([('H', 12), ('M', 6), ('L', 2)])
+        conflicts.append((section_1, section_2, severity, overlap))
+
+    edges = solver.build_edges(problem, conflicts)
+    overlapping_timeslots, timeslot_gaps = solver.calculate_overlapping_timeslots_and_gaps(
+                                                SEARCH_TIMESLOTS, as_matrices = True)
+
+    return problem, edges, overlapping_timeslots, timeslot_gaps
+
+
+class ConvertConflictsTest(unittest.TestCase):
+
+    SECTIONS = ['ARA_101_1', 'CHM_220_1', 'CHM_220L_1_LAB', 'CHM_220L_2_LAB',
+                'BIO_308_1', 'BIO_308_1_CHM_220_1', 'BIO_121_1', 'BIO_121_1_LAB',
+                'CHM_120_1', 'CHM_120_1_LAB', 'CMS_167_1', 'MAT_111_1']
+
+    CONFLICTS = [('ARA_101', 'CHM_220L', 'H', 30),
+                 ('ARA_101', 'CHM_220', 'H', 30),
+                 ('BIO_308', 'CHM_220', 'H', 30),
+                 ('BIO_121', 'CHM_120', 'H', 30),
+                 ('CMS_167', 'MAT_111', 'H', 30),
+                 ('ARA_101', 'MAT_111', 'H', 30),
+                 ('ARA_101', 'BIO_308', 'H', 9)]
+
+    def test_overrides_match_baseline(self):
+        problem = make_problem(self.SECTIONS)
+        converted = solver.convert_conflicts(problem, self.CONFLICTS)
+
+        self.assertTrue(len(converted) > 0)
+
+        for section_1, section_2, weight, overlap in converted:
+            if baseline_light_override(section_1, section_2):
+                self.assertEqual((weight, overlap), ('L', 2), (section_1, section_2))
+            else:
+                self.assertNotEqual(weight, 'L', (section_1, section_2))
+
+    def test_lab_sections_of_an_override_course_are_light(self):
+        problem = make_problem(self.SECTIONS)
+        converted = solver.convert_conflicts(problem, [('ARA_101', 'CHM_220L', 'H', 30)])
+
+        self.assertEqual(sorted(converted),
+                         [('ARA_101_1', 'CHM_220L_1_LAB', 'L', 2),
+                          ('ARA_101_1', 'CHM_220L_2_LAB', 'L', 2)])
+
+
+class SearchTrailTest(unittest.TestCase):
+
+    SECTIONS = ['ARA_101_1', 'BIO_308_1_CHM_220_1', 'CHM_220_1', 'MAT_111_1']
+
+    # The combined section is paired with itself
+    CONFLICTS = [('BIO_308_1_CHM_220_1', 'BIO_308_1_CHM_220_1', 'H', 12),
+                 ('ARA_101_1', 'BIO_308_1_CHM_220_1', 'M', 6),
+                 ('ARA_101_1', 'CHM_220_1', 'L', 2),
+                 ('CHM_220_1', 'MAT_111_1', 'H', 12)]
+
+    def assert_features_match(self, trail):
+        expected = solver.priority_function(trail.solution, trail.problem, trail.edges,
+                                            trail.overlapping_timeslots, trail.timeslot_gaps)
+        for value, expected_value in zip(trail.features, expected):
+            self.assertAlmostEqual(value, expected_value)
+
+    def test_features_follow_assignments_and_undo(self):
+        problem = make_problem(self.SECTIONS)
+        edges = solver.build_edges(problem, self.CONFLICTS)
+        overlapping_timeslots, timeslot_gaps = solver.calculate_overlapping_timeslots_and_gaps(
+                                                    TIMESLOTS, as_matrices = True)
+
+        trail = solver.SearchTrail(problem, edges, overlapping_timeslots, timeslot_gaps)
+        root = trail.node
+        self.assert_features_match(trail)
+
+        for vertex, timeslot, room in [(1, 0, 0), (0, 0, 1), (2, 1, 0), (3, 2, 1)]:
+            trail.push(vertex, timeslot, room)
+            self.assert_features_match(trail)
+
+        leaf = trail.node
+
+        trail.goto(root)
+        self.assert_features_match(trail)
+
+        # Three edges seen from both ends; the self-pair is dropped
+        self.assertEqual(trail.features[2], 6)
+
+        trail.goto(leaf)
+        self.assert_features_match(trail)
+
+
+class PenaltyTotalsTest(unittest.TestCase):
+
+    def test_running_totals_match_recompute_with_a_self_pair(self):
+        problem = make_problem(SearchTrailTest.SECTIONS)
+        edges = solver.build_edges(problem, SearchTrailTest.CONFLICTS)
+        overlapping_timeslots, timeslot_gaps = solver.calculate_overlapping_timeslots_and_gaps(
+                                                    TIMESLOTS, as_matrices = True)
+
+        solution = {}
+        for vertex, timeslot, room in [(1, 0, 0), (0, 0, 1), (2, 1, 0), (3, 1, 1)]:
+            solution[vertex] = (timeslot, room)
+            solver.update_penalties_and_room_lists(vertex, timeslot, room, problem, solution,
+                                                    edges, overlapping_timeslots, timeslot_gaps)
+
+            expected = solver.calculate_total_penalty(solution, edges, overlapping_timeslots,
+                                                        timeslot_gaps, problem)
+            self.assertEqual(problem.penalty_totals.total(), expected)
+
+        # The combined section only pays for its overlap with ARA_101_1
+        self.assertEqual(solver.section_cost(1, 0, problem),
+                         solver.CONFLICT_PENALTY_WEIGHT * solver.MEDIUM_CONFLICT_PENALTY)
+
+
+class SimulatedAnnealingTest(unittest.TestCase):
+
+    def run_annealing(self, cooling):
+        problem = make_problem(SearchTrailTest.SECTIONS)
+        edges = solver.build_edges(problem, SearchTrailTest.CONFLICTS)
+        overlapping_timeslots, timeslot_gaps = solver.calculate_overlapping_timeslots_and_gaps(
+                                                    TIMESLOTS, as_matrices = True)
+        solution = solver.one_pass_solver(problem, edges, overlapping_timeslots, timeslot_gaps)
+
+        events = []
+        monitor = solver.SolveMonitor(on_progress = events.append)
+        solver.simulated_annealing(solution, problem, edges, overlapping_timeslots,
+                                    timeslot_gaps, time_limit = None, max_steps = 1000,
+                                    cooling = cooling, monitor = monitor)
+
+        return events[-1]['iteration']
+
+    def test_runs_every_step_without_a_time_limit(self):
+        self.assertEqual(self.run_annealing('geometric'), 1000)
+        self.assertEqual(self.run_annealing('adaptive'), 1000)
+
+
+class SearchStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.problem, self.edges, self.overlapping_timeslots, self.timeslot_gaps = \
+            make_search_problem()
+        self.empty_problem = self.problem.copy()
+
+        self.solution = solver.one_pass_solver(self.problem, self.edges,
+                                                self.overlapping_timeslots, self.timeslot_gaps)
+
+    #--- Check that the incremental state of the problem matches the
+    # state of the solution assigned from scratch
+    def assert_state_matches_fresh(self):
+        problem = self.problem
+        n = problem.num_sections
+        fresh = solver.assign_solution(self.solution, self.empty_problem.copy(), self.edges,
+                                        self.overlapping_timeslots, self.timeslot_gaps)
+
+        self.assertEqual(len(self.solution), n)
+        self.assertTrue(np.array_equal(problem.assigned_timeslot[:n], fresh.assigned_timeslot[:n]))
+        self.assertTrue(np.array_equal(problem.assigned_room[:n], fresh.assigned_room[:n]))
+        self.assertTrue(np.allclose(problem.conflict_penalty[:n], fresh.conflict_penalty[:n]))
+        self.assertTrue(np.allclose(problem.proximity_penalty[:n], fresh.proximity_penalty[:n]))
+        self.assertEqual(problem.unassigned_rooms, fresh.unassigned_rooms)
+        self.assertTrue(np.array_equal(problem.has_open_room[:n], fresh.has_open_room[:n]))
+        self.assertTrue(np.array_equal(problem.room_occupancy, fresh.room_occupancy))
+        self.assertTrue(np.array_equal(problem.sole_room_count, fresh.sole_room_count))
+
+        totals = problem.penalty_totals
+        fresh_totals = fresh.penalty_totals
+        self.assertEqual(totals.conflict_penalty, fresh_totals.conflict_penalty)
+        self.assertAlmostEqual(totals.proximity_penalty, fresh_totals.proximity_penalty)
+        self.assertEqual(totals.num_conflicts, fresh_totals.num_conflicts)
+        self.assertEqual(totals.num_unassigned, fresh_totals.num_unassigned)
+        self.assertAlmostEqual(totals.total(),
+                               solver.calculate_total_penalty(self.solution, self.edges,
+                                                                self.overlapping_timeslots,
+                                                                self.timeslot_gaps, problem))
+
+    def test_one_pass(self):
+        self.assert_state_matches_fresh()
+
+    def test_tabu_search(self):
+        self.solution = solver.tabu_search(self.solution, self.problem, self.edges,
+                                            self.overlapping_timeslots, self.timeslot_gaps,
+                                            max_iterations = 200)
+        self.assert_state_matches_fresh()
+
+    def test_simulated_annealing(self):
+        self.solution = solver.simulated_annealing(self.solution, self.problem, self.edges,
+                                                    self.overlapping_timeslots,
+                                                    self.timeslot_gaps, time_limit = None,
+                                                    max_steps = 2000)
+        self.assert_state_matches_fresh()
+
+    def test_large_neighborhood_search(self):
+        self.solution = solver.large_neighborhood_search(self.solution, self.problem,
+                                                            self.edges,
+                                                            self.overlapping_timeslots,
+                                                            self.timeslot_gaps,
+                                                            time_limit = None,
+                                                            max_iterations = 100, size = 6)
+        self.assert_state_matches_fresh()
+
+
+class TimeslotCacheTest(unittest.TestCase):
+
+    # Includes a timeslot with two meetings on one day and one off the
+    # grid of the week masks
+    TIMESLOTS = SEARCH_TIMESLOTS + ['8 TR 3:30 pm - 4:45 pm ; T 6:00 pm - 7:00 pm',
+                                    '9 MWF 11:02 am - 11:53 am']
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip_matches_calculation(self):
+        expected_overlaps, expected_gaps = solver.calculate_overlapping_timeslots_and_gaps(
+                                                self.TIMESLOTS, as_matrices = True)
+
+        for attempt in ['miss', 'hit']:
+            overlaps, gaps = solver.cached_overlapping_timeslots_and_gaps(self.TIMESLOTS,
+                                                                            self.cache_dir)
+            self.assertTrue(np.array_equal(overlaps, expected_overlaps), attempt)
+            self.assertTrue(np.array_equal(gaps, expected_gaps), attempt)
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # Each pair agrees with the meeting by meeting comparison
+        parsed = [solver.ParsedTimeslot(t) for t in self.TIMESLOTS]
+        for i in range(len(parsed)):
+            for j in range(len(parsed)):
+                overlap_exists, gap = parsed[i].overlap_and_gap(parsed[j])
+                self.assertEqual(overlaps[i, j], overlap_exists)
+                self.assertEqual(gaps[i, j], round(gap))
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.problem, self.edges, self.overlapping_timeslots, self.timeslot_gaps = \
+            make_search_problem()
+
+    def assert_complete_by(self, strategy, time_limit):
+        start_time = time.time()
+        solution, problem = solver.solve(self.problem.copy(), self.edges,
+                                            self.overlapping_timeslots, self.timeslot_gaps,
+                                            strategy, deadline = start_time + time_limit)
+
+        self.assertTrue(time.time() - start_time < time_limit + 0.25, strategy)
+        self.assertEqual(sorted(solution), range(problem.num_sections))
+        self.assertAlmostEqual(problem.penalty_totals.total(),
+                               solver.calculate_total_penalty(solution, self.edges,
+                                                                self.overlapping_timeslots,
+                                                                self.timeslot_gaps, problem))
+
+    def test_strategies_return_complete_schedules_by_deadline(self):
+        for strategy in ['one_pass', 'lns', 'priority_queue']:
+            self.assert_complete_by(strategy, 0.5)
+            self.assert_complete_by(strategy, 0.0)
+
+
+class MultiStartTest(unittest.TestCase):
+
+    # The priority queue search runs in one process, so the multi-start
+    # solver is the one whose results could depend on the worker count
+    def test_results_do_not_depend_on_processes(self):
+        problem, edges, overlapping_timeslots, timeslot_gaps = make_search_problem()
+
+        runs = []
+        for processes in [1, 2]:
+            solution, best_problem, results = solver.multi_start_solver(
+                problem, edges, overlapping_timeslots, timeslot_gaps, range(3),
+                processes = processes)
+            runs.append((solution, results))
+
+        self.assertEqual(runs[0], runs[1])
+
+        # The problem passed in is left without assignments
+        self.assertEqual(problem.penalty_totals.total(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,8 @@ from flask import jsonify, request
 from flask_sqlalchemy import SQLAlchemy
 import json
 import os
+import time
 import solver
-from datetime import datetime
-import copy
 
 app = Flask(__name__)
 
@@ -17,6 +16,9 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db/schedule.db'
 db = SQLAlchemy(app)
 
+# Seconds a scheduling request may take, including reading the database
+SCHEDULE_TIME_LIMIT = 10.0
+
 # Each database table is described by a class that extends db.Model
 
 
@@ -692,49 +694,9 @@ def convert_section_name_to_course_name(name):
 #   True if the timeslots overlap
 def are_overlapping_timeslots(slot1, slot2):
     
-    # The slots may be custom composites
-    # Split into the component parts
-    slot1_components = slot1.split(' ; ')
-    slot2_components = slot2.split(' ; ')
-    
-    # Compare all components of the two timeslots to see if they overlap
-    # in any part
-    for t1 in slot1_components:
-        for t2 in slot2_components:
-            
-            # Extract the meeting days 
-            fields1 = t1.split(' ')
-            fields2 = t2.split(' ')
-            
-            days1 = fields1[0]
-            days2 = fields2[0]
-            
-            for d in 'MTWRF':
-                
-                # Only check pairs that meet on the same day
-                if d not in days1 or d not in days2:
-                    continue
-                
-                # The times overlap if the start time for one occurs between
-                # the start and end times of the other
-                start_time_1 = fields1[1]
-                end_time_1 = fields1[3]
-                start_time_2 = fields2[1]
-                end_time_2 = fields2[3]
-                
-                print start_time_1, end_time_1, start_time_2, end_time_2
-                
-                if ((start_time_1 >= start_time_2 and start_time_1 <= end_time_2) or
-                    (start_time_2 >= start_time_1 and start_time_2 <= end_time_1)):
-                        
-                        print str(start_time_1 >= start_time_2 and start_time_1 <= end_time_2)
-                        print str(start_time_2 >= start_time_1 and start_time_2 <= end_time_1)
-
-                        # Stop checking once we find a single overlap
-                        return True
-                        
-    # All checks are complete and no overlaps were found
-    return False
+    # The slots may be custom composites: they overlap if any of their
+    # components meet at the same time on the same day
+    return solver.ParsedTimeslot(slot1).overlaps(solver.ParsedTimeslot(slot2))
     
 
 # Identify the heavy, medium, and light conflicts for a given course at
@@ -936,6 +898,8 @@ def set_assigned_timeslot_and_room():
 @app.route('/schedule_with_one_pass', methods=['GET'])
 def schedule_with_one_pass():
     
+    deadline = time.time() + SCHEDULE_TIME_LIMIT
+
     # Pull rooms from the database
     room_results = Room.query.all();
     room_list = [r.building + '_' + r.room_number for r in room_results]
@@ -948,33 +912,10 @@ def schedule_with_one_pass():
     unique_timeslot_strings = list(set(timeslots_with_duplicates))
     print unique_timeslot_strings
     
-    # Convert the timeslots string to 12-hour format
-    #
-    # This is required for backwards-compatibility with the previous solver
-    # and old input file formats
-    timeslots_12_hour = []
-    timeslots_24_hour = []
-    for t in unique_timeslot_strings:
-        new_string = ''
-        
-        fields = t.split(' ')
-        new_string += fields[0] + ' '
-        d = datetime.strptime(fields[1], "%H:%M")
-        new_string += d.strftime("%I:%M %p")
-        new_string += ' - '
-        d = datetime.strptime(fields[3], "%H:%M")
-        new_string += d.strftime("%I:%M %p")
-        
-        new_string = new_string.replace('AM', 'am')
-        new_string = new_string.replace('PM', 'pm')
-
-        timeslots_12_hour.append(new_string)
-        timeslots_24_hour.append(t)
-    
-    timeslot_ids = range(len(unique_timeslot_strings))
-
     # Assign each timeslot a unique id
-    timeslots_with_ids = [str(i) + ' ' + timeslots_12_hour[i] for i in range(len(timeslots_12_hour))]
+    #
+    # The solver parses the 24-hour strings directly
+    timeslots_with_ids = [str(i) + ' ' + unique_timeslot_strings[i] for i in range(len(unique_timeslot_strings))]
     print timeslots_with_ids
     
     # Pull the list of instructors from the database
@@ -982,16 +923,15 @@ def schedule_with_one_pass():
     instructors = [i.name for i in instructor_results]
     print instructors
     
-    # Build the vertices structure with one entry per section
+    # Build the problem model with one entry per section
     section_results = Section.query.all();
     
     # Keep track of the name transformations so we can undo them after the
     # schedule has been constructed
     transformed_to_original_names_map = {}
     
-    vertices = {}
+    problem = solver.ProblemInstance(timeslots_with_ids, room_list)
     for s in section_results:
-        new_section = {}
         
         fields = s.section_name.split(' ')
         prefix = fields[0]
@@ -1004,37 +944,27 @@ def schedule_with_one_pass():
         if lecture_or_lab.lower() == 'lab':
             section_name += '_LAB'
     
-        new_section['name'] = section_name
         transformed_to_original_names_map[section_name] = s.section_name
     
         # Get the acceptable rooms
         acceptable_rooms = AcceptableRoom.query.filter_by(section_name = s.section_name).all()
-        new_section['acceptable_rooms'] = [r.building + '_' + r.room_number for r in acceptable_rooms]
+        acceptable_room_names = [r.building + '_' + r.room_number for r in acceptable_rooms]
         
         # Get the acceptable timeslot ids
         acceptable_timeslots = AcceptableTimeslot.query.filter_by(section_name = s.section_name).all()
         acceptable_timeslot_ids = [unique_timeslot_strings.index(a.timeslot_string) for a in acceptable_timeslots]
-        new_section['acceptable_timeslots'] = acceptable_timeslot_ids
         
         # Instructor
         instructor = s.instructor
         instructor = instructor.replace(',', '')
         instructor = instructor.replace('.', '')
         instructor = instructor.replace(' ', '_')
-        new_section['instructor'] = instructor
         
-        print new_section
+        print section_name, acceptable_timeslot_ids, acceptable_room_names, instructor
         
-        vertices[section_name] = new_section
-        
-    # Intialize unavailable rooms for each acceptable timeslot
-    for course in vertices:
-        for timeslot in vertices[course]['acceptable_timeslots']:
-            vertices[course][timeslot] = {}
-            vertices[course][timeslot]['unassigned_rooms'] = copy.copy(vertices[course]['acceptable_rooms'])
-            
-            vertices[course][timeslot]['conflict_penalty'] = 0.0
-            vertices[course][timeslot]['proximity_penalty'] = 0.0
+        # The problem initializes the unassigned rooms and penalties for
+        # each acceptable timeslot
+        problem.add_section(section_name, instructor, acceptable_timeslot_ids, acceptable_room_names)
     
     # Initialize the set of conflicts
     conflict_query_results = Conflict.query.all()
@@ -1115,13 +1045,15 @@ def schedule_with_one_pass():
     print conflicts
     
     # Build the edges of the graph model
-    edges = solver.build_edges(vertices, conflicts)
+    edges = solver.build_edges(problem, conflicts)
     
     # Calculate overlaps and gaps for each pair of timeslots
-    overlapping_timeslots, timeslot_gaps = solver.calculate_overlapping_timeslots_and_gaps(timeslots_with_ids)
+    overlapping_timeslots, timeslot_gaps = solver.cached_overlapping_timeslots_and_gaps(timeslots_with_ids)
 
-    # Call the one-pass scheduler
-    solution = solver.one_pass_solver(vertices, edges, overlapping_timeslots, timeslot_gaps)
+    # Call the one-pass scheduler, within the time limit of the request
+    solution, problem = solver.solve(problem, edges, overlapping_timeslots, timeslot_gaps,
+                                        'one_pass', deadline = deadline, improve = False)
+    solution = problem.named_solution(solution)
     
     # Enter the assigned timeslot/room for each section into the database
     for c in solution:
@@ -1129,7 +1061,7 @@ def schedule_with_one_pass():
 
         # Convert timeslot id into its 24-hour string representation
         if result['assigned_timeslot'] != None:
-            timeslot_string = timeslots_24_hour[result['assigned_timeslot']]
+            timeslot_string = unique_timeslot_strings[result['assigned_timeslot']]
         else:
             timeslot_string = 'None'
         